@@ -7,6 +7,7 @@ import time
 import random
 import numpy as np
 from PIL import Image
+import json
 import threading
 
 if '2.7' in sys.version:
@@ -14,15 +15,150 @@ if '2.7' in sys.version:
 else:
     import queue
 
+# lib 在上一级目录
+sys.path.append(os.path.split(os.path.abspath(os.path.split(__file__)[0]))[0])
+from lib.dataset import FileIndex
+from lib.img import pad_image
+from img_cache import ImgCache
+
+
+'''
+ 按猪分组的文件列表 {pig_id: [[file_name, file_path], ...]} (每组按文件名排序)
+ 结果缓存在 FileIndex 里，30 个网络的 训练集、校验集 共用，只计算一次；不要修改返回的结果
+'''
+
+
+def get_pig_group(data_root):
+    def __group(file_list):
+        pig_group = {}
+        for stem, file_name, no_list in file_list:
+            if int(no_list[-1]) == 1:
+                continue
+
+            pig_id = int(no_list[0]) - 1
+            if pig_id not in pig_group:
+                pig_group[pig_id] = []
+            pig_group[pig_id].append([stem, os.path.join(data_root, file_name)])
+
+        for pig_id, pig_list in pig_group.items():
+            pig_list.sort(key=lambda x: x[0])
+        return pig_group
+
+    return FileIndex.get(data_root).memoize('pig_group', __group)
+
+
+'''
+ 读取 补黑边 + resize 后的图片；有 img_cache.py 建立的缓存时直接读取缓存
+'''
+
+
+def read_image(img_path, resize, ratio=1.0):
+    cache = ImgCache.get(Data.DATA_ROOT, resize, ratio)
+    np_image = cache.lookup(img_path) if cache.exist() else None
+    return np_image if not isinstance(np_image, type(None)) else pad_image(Image.open(img_path), resize, ratio)
+
+
+'''
+ 特征缓存: 每张图片经过冻结的网络主干 (如 VGG 的卷积层) 后的特征 (float32)
+    FEATURE_DIR/<name>.npy 保存全部特征 (memmap)，<name>.json 保存每一行对应的文件名 以及 提取特征时的信息 (info)
+    Data、TestData 传入 feature_store 时，返回的 x 为缓存的特征而不是图片
+ 写入: writer = store.create(file_list, dim); writer[i] = ...; store.commit(writer, info)
+'''
+
+
+class FeatureStore:
+    FEATURE_DIR = r'../data/feature'
+
+    def __init__(self, name):
+        self.__npy_path = os.path.join(self.FEATURE_DIR, name + '.npy')
+        self.__index_path = os.path.join(self.FEATURE_DIR, name + '.json')
+
+        self.__features = None
+        self.__row = {}  # file_name -> 行号
+        self.__info = {}
+        self.__new_file_list = []
+
+        self.__open()
+
+    def __open(self):
+        self.__features = None
+        self.__row = {}
+        self.__info = {}
+        if not os.path.isfile(self.__npy_path) or not os.path.isfile(self.__index_path):
+            return
+
+        with open(self.__index_path, 'r') as f:
+            index = json.load(f)
+
+        self.__features = np.load(self.__npy_path, mmap_mode='r')
+        self.__row = {file_name: i for i, file_name in enumerate(index['file_list'])}
+        self.__info = index['info']
+
+    ''' 特征是否存在 '''
+
+    def exist(self):
+        return not isinstance(self.__features, type(None))
+
+    ''' 是否包含 file_list 里的全部文件 '''
+
+    def contain(self, file_list):
+        return self.exist() and all(file_name in self.__row for file_name in file_list)
+
+    ''' 提取特征时保存的信息 '''
+
+    def get_info(self):
+        return self.__info
+
+    ''' 获取某张图片的特征 '''
+
+    def lookup(self, img_path):
+        return self.__features[self.__row[os.path.split(img_path)[1]]]
+
+    ''' 新建保存特征的 memmap (临时文件)，写完后调用 commit '''
+
+    def create(self, file_list, dim):
+        if not os.path.isdir(self.FEATURE_DIR):
+            os.makedirs(self.FEATURE_DIR)
+
+        self.__new_file_list = list(file_list)
+        return np.lib.format.open_memmap(self.__npy_path + '.tmp', mode='w+', dtype=np.float32,
+                                         shape=(len(file_list), dim))
+
+    ''' 保存特征；替换旧的文件 '''
+
+    def commit(self, writer, info=None):
+        writer.flush()
+        del writer
+        self.__features = None  # 关闭旧的 memmap，才能替换文件
+
+        if os.path.isfile(self.__npy_path):
+            os.remove(self.__npy_path)
+        os.rename(self.__npy_path + '.tmp', self.__npy_path)
+
+        with open(self.__index_path + '.tmp', 'w') as f:
+            json.dump({'file_list': self.__new_file_list, 'info': info if info else {}}, f)
+        if os.path.isfile(self.__index_path):
+            os.remove(self.__index_path)
+        os.rename(self.__index_path + '.tmp', self.__index_path)
+
+        self.__open()
+
+
+'''
+ 加载 pig_id 的二分类数据；y = 1 为该猪，y = 0 为其他猪 (各占一半)
+ feature_store 不为 None 时，x 为 feature_store 里缓存的特征
+'''
+
 
 class Data:
     DATA_ROOT = r'../data/TrainImgMore'
     RESIZE = [224, 224]
     # RESIZE = [39, 39]
     RATIO = 1.0
+    USE_CACHE = True  # 有 img_cache.py 建立的图片缓存时直接读取缓存
     NUM_CLASSES = 2
 
-    def __init__(self, pig_id, start_ratio=0.0, end_ratio=1.0, name='', resize=None):
+    def __init__(self, pig_id, start_ratio=0.0, end_ratio=1.0, name='', resize=None, feature_store=None):
         self.__chang_dir()
 
         # 初始化变量
@@ -32,6 +168,10 @@ class Data:
         self.__diff_data = []
         self.__data = {}
         self.__resize = resize if resize else self.RESIZE
+        self.__feature_store = feature_store
+        self.__cache = ImgCache.get(self.DATA_ROOT, self.__resize, self.RATIO) if self.USE_CACHE else None
+        if self.__cache and not self.__cache.exist():
+            self.__cache = None
 
         # 加载全部数据
         self.__load()
@@ -83,31 +223,8 @@ class Data:
 
     def __load(self):
         self.echo('Loading %s_%d data ...' % (self.__name, self.__pig_id))
-        file_list = os.listdir(self.DATA_ROOT)
-        file_len = len(file_list)
-
-        for i, file_name in enumerate(file_list):
-            progress = float(i + 1) / file_len * 100
-            self.echo('\r >> progress: %.2f%% \t' % progress, False)
-
-            split_file_name = os.path.splitext(file_name)
-            no_list = split_file_name[0].split('_')
-
-            if split_file_name[1].lower() != '.jpg' or int(no_list[-1]) == 1:
-                continue
-
-            pig_id = int(split_file_name[0].split('_')[0]) - 1
-            file_path = os.path.join(self.DATA_ROOT, file_name)
-
-            if pig_id not in self.__data:
-                self.__data[pig_id] = []
-            self.__data[pig_id].append([split_file_name[0], file_path])
-
-        self.echo(' sorting data ... ')
-        for pig_id, pig_list in self.__data.items():
-            pig_list.sort(key=lambda x: x[0])
-
-        self.echo('\nFinish Loading\n')
+        self.__data = get_pig_group(self.DATA_ROOT)
+        self.echo('Finish Loading\n')
 
     def __get_data(self):
         max_q_size = min(self.__data_len, 500)
@@ -144,6 +261,8 @@ class Data:
         label = np.zeros([Data.NUM_CLASSES])
         label[y] = 1
 
+        if self.__feature_store:
+            return self.__feature_store.lookup(img_path), label
         return self.add_padding(img_path), label
 
     # @staticmethod
@@ -170,33 +289,14 @@ class Data:
     def __resize_np_img(self, np_image):
         return np.array(Image.fromarray(np_image).resize(self.__resize), dtype=np.float32)
 
-    def add_padding(self, img_path):
-        image = Image.open(img_path)
-        w, h = image.size
-        ratio = float(w) / h
-
-        if abs(ratio - Data.RATIO) <= 0.1:
-            return np.array(image.resize(self.__resize))
-
-        np_image = np.array(image)
-        h, w, c = np_image.shape
+    ''' 补黑边再 resize；有缓存时直接读取缓存 '''
 
-        if ratio > Data.RATIO:
-            new_h = int(float(w) / Data.RATIO)
-            padding = int((new_h - h) / 2.0)
-
-            np_new_image = np.zeros([new_h, w, c])
-            np_new_image[padding: padding + h, :, :] = np_image
-
-        else:
-            new_w = int(float(h) * Data.RATIO)
-            padding = int((new_w - w) / 2.0)
-
-            np_new_image = np.zeros([h, new_w, c])
-            np_new_image[:, padding: padding + w, :] = np_image
-
-        new_image = Image.fromarray(np.cast['uint8'](np_new_image))
-        return np.array(new_image.resize(self.__resize))
+    def add_padding(self, img_path):
+        if self.__cache:
+            np_image = self.__cache.lookup(img_path)
+            if np_image is not None:
+                return np_image
+        return pad_image(Image.open(img_path), self.__resize, Data.RATIO)
 
     def next_batch(self, batch_size):
         X = []
@@ -231,9 +331,10 @@ class TestData:
     RESIZE = [224, 224]
     # RESIZE = [39, 39]
     RATIO = 1.0
+    USE_CACHE = True  # 有 img_cache.py 建立的图片缓存时直接读取缓存
     NUM_CLASSES = 30
 
-    def __init__(self, start_ratio=0.0, end_ratio=1.0, name='', resize=None):
+    def __init__(self, start_ratio=0.0, end_ratio=1.0, name='', resize=None, feature_store=None):
         self.__chang_dir()
 
         # 初始化变量
@@ -241,6 +342,10 @@ class TestData:
         self.__data = {}
         self.__data_list = []
         self.__resize = resize if resize else self.RESIZE
+        self.__feature_store = feature_store
+        self.__cache = ImgCache.get(self.DATA_ROOT, self.__resize, self.RATIO) if self.USE_CACHE else None
+        if self.__cache and not self.__cache.exist():
+            self.__cache = None
 
         # 加载全部数据
         self.__load()
@@ -280,33 +385,12 @@ class TestData:
 
     def __load(self):
         self.echo('Loading %s data ...' % self.__name)
-        file_list = os.listdir(self.DATA_ROOT)
-        file_len = len(file_list)
-
-        for i, file_name in enumerate(file_list):
-            progress = float(i + 1) / file_len * 100
-            self.echo('\r >> progress: %.2f%% \t' % progress, False)
-
-            split_file_name = os.path.splitext(file_name)
-            no_list = split_file_name[0].split('_')
-
-            if split_file_name[1].lower() != '.jpg' or int(no_list[-1]) == 1:
-                continue
-
-            pig_id = int(split_file_name[0].split('_')[0]) - 1
-            file_path = os.path.join(self.DATA_ROOT, file_name)
-
-            if pig_id not in self.__data:
-                self.__data[pig_id] = []
-            self.__data[pig_id].append([split_file_name[0], file_path])
-
-        self.echo(' sorting data ... ')
-        for pig_id, pig_list in self.__data.items():
-            pig_list.sort(key=lambda x: x[0])
-
-        self.echo('\nFinish Loading\n')
+        self.__data = get_pig_group(self.DATA_ROOT)
+        self.echo('Finish Loading\n')
 
     def __get_x_y(self, img_path):
+        if self.__feature_store:
+            return self.__feature_store.lookup(img_path), TestData.__get_y(img_path)
         return self.add_padding(img_path), TestData.__get_y(img_path)
 
     @staticmethod
@@ -322,33 +406,14 @@ class TestData:
     def __resize_np_img(self, np_image):
         return np.array(Image.fromarray(np_image).resize(self.__resize), dtype=np.float32)
 
-    def add_padding(self, img_path):
-        image = Image.open(img_path)
-        w, h = image.size
-        ratio = float(w) / h
-
-        if abs(ratio - Data.RATIO) <= 0.1:
-            return np.array(image.resize(self.__resize))
-
-        np_image = np.array(image)
-        h, w, c = np_image.shape
+    ''' 补黑边再 resize；有缓存时直接读取缓存 '''
 
-        if ratio > Data.RATIO:
-            new_h = int(float(w) / Data.RATIO)
-            padding = int((new_h - h) / 2.0)
-
-            np_new_image = np.zeros([new_h, w, c])
-            np_new_image[padding: padding + h, :, :] = np_image
-
-        else:
-            new_w = int(float(h) * Data.RATIO)
-            padding = int((new_w - w) / 2.0)
-
-            np_new_image = np.zeros([h, new_w, c])
-            np_new_image[:, padding: padding + w, :] = np_image
-
-        new_image = Image.fromarray(np.cast['uint8'](np_new_image))
-        return np.array(new_image.resize(self.__resize))
+    def add_padding(self, img_path):
+        if self.__cache:
+            np_image = self.__cache.lookup(img_path)
+            if np_image is not None:
+                return np_image
+        return pad_image(Image.open(img_path), self.__resize, Data.RATIO)
 
     def __read_img_list(self, img_list):
         X = []
@@ -429,6 +494,7 @@ class TestBData:
     RESIZE = [224, 224]
     # RESIZE = [39, 39]
     RATIO = 1.0
+    USE_CACHE = True  # 有 img_cache.py 建立的图片缓存时直接读取缓存
     NUM_CLASSES = 30
 
     def __init__(self, resize=None):
@@ -437,6 +503,9 @@ class TestBData:
         # 初始化变量
         self.__data = []
         self.__resize = resize if resize else self.RESIZE
+        self.__cache = ImgCache.get(self.DATA_ROOT, self.__resize, self.RATIO) if self.USE_CACHE else None
+        if self.__cache and not self.__cache.exist():
+            self.__cache = None
 
         # 加载全部数据
         self.__load()
@@ -459,26 +528,17 @@ class TestBData:
 
     def __load(self):
         self.echo('Loading Test_B data ...')
-        file_list = os.listdir(self.DATA_ROOT)
-        file_len = len(file_list)
 
-        for i, file_name in enumerate(file_list):
-            progress = float(i + 1) / file_len * 100
-            self.echo('\r >> progress: %.2f%% \t' % progress, False)
-
-            split_file_name = os.path.splitext(file_name)
-            no_list = split_file_name[0].split('_')
-
-            if split_file_name[1].lower() != '.jpg' or 'pig' not in split_file_name[0].lower() \
-                    or 'MACOSX' in split_file_name[0]:
+        for stem, file_name, no_list in FileIndex.get(self.DATA_ROOT).get_list():
+            if 'pig' not in stem.lower() or 'MACOSX' in stem:
                 continue
 
-            pig_id = int(split_file_name[0].split('_')[0])
+            pig_id = int(no_list[0])
             file_path = os.path.join(self.DATA_ROOT, file_name)
 
             self.__data.append([pig_id, file_path])
 
-        self.echo('\nFinish Loading\n')
+        self.echo('Finish Loading\n')
 
     def __get_x_y(self, img_path):
         return self.add_padding(img_path), TestBData.__get_y(img_path)
@@ -491,33 +551,14 @@ class TestBData:
     def __resize_np_img(self, np_image):
         return np.array(Image.fromarray(np_image).resize(self.__resize), dtype=np.float32)
 
-    def add_padding(self, img_path):
-        image = Image.open(img_path)
-        w, h = image.size
-        ratio = float(w) / h
-
-        if abs(ratio - Data.RATIO) <= 0.1:
-            return np.array(image.resize(self.__resize))
-
-        np_image = np.array(image)
-        h, w, c = np_image.shape
-
-        if ratio > Data.RATIO:
-            new_h = int(float(w) / Data.RATIO)
-            padding = int((new_h - h) / 2.0)
+    ''' 补黑边再 resize；有缓存时直接读取缓存 '''
 
-            np_new_image = np.zeros([new_h, w, c])
-            np_new_image[padding: padding + h, :, :] = np_image
-
-        else:
-            new_w = int(float(h) * Data.RATIO)
-            padding = int((new_w - w) / 2.0)
-
-            np_new_image = np.zeros([h, new_w, c])
-            np_new_image[:, padding: padding + w, :] = np_image
-
-        new_image = Image.fromarray(np.cast['uint8'](np_new_image))
-        return np.array(new_image.resize(self.__resize))
+    def add_padding(self, img_path):
+        if self.__cache:
+            np_image = self.__cache.lookup(img_path)
+            if np_image is not None:
+                return np_image
+        return pad_image(Image.open(img_path), self.__resize, Data.RATIO)
 
     def __read_img_list(self, img_list):
         X = []
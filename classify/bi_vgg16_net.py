@@ -3,7 +3,10 @@
 import os
 import sys
 import csv
+import json
 import math
+import random
+import multiprocessing
 import numpy as np
 import tensorflow as tf
 
@@ -17,6 +20,7 @@ if cur_dir_path:
 import bi_load as load
 import lib.base as base
 import model.vgg as vgg
+from lib.parallel import imap_tasks
 
 ''' 
  全卷积神经网络 
@@ -143,6 +147,24 @@ class VGG16(base.NN):
     USE_BN = True  # 网络里是否使用了 batch normalize
     USE_BN_INPUT = True  # 输入是否使用 batch normalize
 
+    # 冻结 VGG 主干 (TRUNK_LAYER 及之前的层，不使用 bn)：每张图片只经过一次主干，特征缓存在 load.FeatureStore，
+    #   30 个网络只训练之后的 fc 层
+    USE_FROZEN_TRUNK = False
+    TRUNK_LAYER = 'pool_5'  # 主干的最后一层
+    FEATURE_BATCH_SIZE = 64  # 提取特征时的 batch 大小
+    NORM_SAMPLE_SIZE = 1000  # 计算主干输入的 mean、std 时使用的图片数量
+
+    # test 时将 30 个网络建在同一个 graph 里，共用同一个主干 (只计算一次)，每个 batch 一次 sess.run 得到 30 个网络的概率；
+    #   需要 USE_FROZEN_TRUNK 为 True (没有冻结主干时每个网络的主干各不相同，没有可以共用的部分)
+    #   test_b 在冻结主干时总是这样计算；没有冻结主干时逐个网络计算
+    USE_MULTI_HEAD = False
+    MULTI_HEAD_BATCH_SIZE = 100  # USE_MULTI_HEAD 时每个 batch 的大小
+
+    # run 时同时训练 NUM_WORKERS 个网络 (每个网络一个子进程)；为 1 时在当前进程逐个训练
+    NUM_WORKERS = 1
+    INTRA_OP_THREADS = 0  # 每个 session 的 intra_op 线程数；0 时多进程训练为 cpu 数 / NUM_WORKERS，否则为 tf 的默认值
+    INTER_OP_THREADS = 0  # 每个 session 的 inter_op 线程数；0 时多进程训练为 2，否则为 tf 的默认值
+
     SHOW_PROGRESS_FREQUENCY = 2  # 每 SHOW_PROGRESS_FREQUENCY 个 step show 一次进度 progress
 
     RESULT_DIR = r'result'
@@ -339,6 +361,74 @@ class VGG16(base.NN):
         self.__train_size_list = [0 for i in range(self.NUM_PIG)]
         self.__val_size_list = [0 for i in range(self.NUM_PIG)]
 
+        self.__feature_store = None
+        if self.USE_FROZEN_TRUNK:
+            trunk_len = [config['name'] for config in self.MODEL].index(self.TRUNK_LAYER) + 1
+            self.__trunk = self.MODEL[:trunk_len]
+            self.MODEL = self.MODEL[trunk_len:]  # 每个网络只需要训练主干之后的层
+
+            self.__feature_store = load.FeatureStore('%s_%s_%dx%d' % (self.MODEL_NAME, self.TRUNK_LAYER,
+                                                                      self.IMAGE_SHAPE[0], self.IMAGE_SHAPE[1]))
+            self.__extract_feature()
+
+    ''' 冻结的主干 (权重为常量，不使用 bn)；输出展平后的特征 '''
+
+    def __parse_trunk(self, X):
+        a = X
+        for config in self.__trunk:
+            with tf.name_scope(config['name']):
+                if config['type'] == 'conv':
+                    a = self.activate(self.conv2d_bias(a, tf.constant(config['W']), tf.constant(config['b'])))
+                elif config['type'] == 'pool':
+                    k_size = [config['k_size'], config['k_size']]
+                    if 'pool_type' not in config or config['pool_type'] == 'max':
+                        a = self.max_pool(a, k_size)
+                    else:
+                        a = self.avg_pool(a, k_size)
+
+        shape = a.get_shape().as_list()
+        return tf.reshape(a, [-1, shape[1] * shape[2] * shape[3]])
+
+    '''
+     提取特征: 每张图片只经过主干一次，结果保存到 FeatureStore；已经提取过全部图片时直接使用
+     主干输入按通道用固定的 mean、std 标准化 (从 NORM_SAMPLE_SIZE 张图片计算)，代替训练时每个 batch 各自的 mean、std
+    '''
+
+    def __extract_feature(self):
+        path_list = [img_path for pig_id, pig_list in sorted(load.get_pig_group(load.Data.DATA_ROOT).items())
+                     for file_name, img_path in pig_list]
+        file_list = [os.path.split(img_path)[1] for img_path in path_list]
+        if self.__feature_store.contain(file_list):
+            return
+
+        self.echo('\nExtracting %s features of %d images ...' % (self.TRUNK_LAYER, len(path_list)))
+
+        sample_list = random.Random(0).sample(path_list, min(self.NORM_SAMPLE_SIZE, len(path_list)))
+        sample_x = np.array([load.read_image(img_path, self.IMAGE_SHAPE, load.Data.RATIO)
+                             for img_path in sample_list], np.float32)
+        mean_x = np.mean(sample_x, axis=(0, 1, 2))
+        std_x = np.std(sample_x, axis=(0, 1, 2))
+        del sample_x
+
+        graph = tf.Graph()
+        with graph.as_default():
+            image = tf.placeholder(tf.uint8, self.IMAGE_PH_SHAPE, name='X')
+            feature = self.__parse_trunk((tf.cast(image, tf.float32) - mean_x) / (std_x + self.EPSILON))
+
+            writer = self.__feature_store.create(file_list, int(feature.get_shape()[-1]))
+            with tf.Session(graph=graph) as sess:
+                for start in range(0, len(path_list), self.FEATURE_BATCH_SIZE):
+                    batch_path = path_list[start: start + self.FEATURE_BATCH_SIZE]
+                    batch_x = np.array([load.read_image(img_path, self.IMAGE_SHAPE, load.Data.RATIO)
+                                        for img_path in batch_path])
+                    writer[start: start + len(batch_path)] = sess.run(feature, {image: batch_x})
+
+                    progress = float(start + len(batch_path)) / len(path_list) * 100
+                    self.echo('\r >> extracting progress: %.2f%% \t' % progress, False)
+
+        self.__feature_store.commit(writer, {'mean_x': mean_x.tolist(), 'std_x': std_x.tolist()})
+        self.echo('\nFinish extracting features ')
+
     def reinit(self, net_id):
         self.net_id = net_id
 
@@ -351,8 +441,11 @@ class VGG16(base.NN):
 
         self.__has_rebuild = False
 
-        # 输入 与 label
-        self.__image = tf.placeholder(tf.float32, self.IMAGE_PH_SHAPE, name='X')
+        # 输入 与 label；冻结主干时输入为缓存的特征 (float32)，否则直接 feed uint8 的图片
+        if self.USE_FROZEN_TRUNK:
+            self.__image = tf.placeholder(tf.float32, [None, self.MODEL[0]['shape'][0]], name='X')
+        else:
+            self.__image = tf.placeholder(tf.uint8, self.IMAGE_PH_SHAPE, name='X')
         self.__label = tf.placeholder(tf.float32, [None, self.NUM_CLASSES], name='y')
         self.__size = tf.placeholder(tf.float32, name='size')
 
@@ -374,16 +467,16 @@ class VGG16(base.NN):
             staircase=False
         )
 
-        self.sess = tf.Session(graph=self.graph)
+        self.sess = tf.Session(graph=self.graph, config=self.__get_session_config())
 
     ''' 加载数据 '''
 
     def load(self):
         self.__train_set_list[self.net_id] = load.Data(self.net_id, 0.0, self.TRAIN_DATA_RATIO, 'train',
-                                                       self.IMAGE_SHAPE)
+                                                       self.IMAGE_SHAPE, self.__feature_store)
         self.__val_set_list[self.net_id] = load.Data(self.net_id, self.TRAIN_DATA_RATIO, self.VAL_DATA_END_RATIO,
                                                      'validation',
-                                                     self.IMAGE_SHAPE)
+                                                     self.IMAGE_SHAPE, self.__feature_store)
 
         self.__train_size_list[self.net_id] = self.__train_set_list[self.net_id].get_size()
         self.__val_size_list[self.net_id] = self.__val_set_list[self.net_id].get_size()
@@ -395,12 +488,20 @@ class VGG16(base.NN):
             self.restore_model_w_b(self.start_from_model)
             self.rebuild_model()
         else:
-            self.__output = self.parse_model(self.__image)
+            self.__output = self.parse_model(self.__normalize(self.__image))
 
     ''' 重建模型 '''
 
     def rebuild_model(self):
-        self.__output = self.parse_model_rebuild(self.__image)
+        self.__output = self.parse_model_rebuild(self.__normalize(self.__image))
+
+    ''' 在图里对输入做 normalize；测试时使用第 net_id 个网络的 mean_x、std_x '''
+
+    def __normalize(self, x, net_id=None):
+        net_id = self.net_id if net_id is None else net_id
+        mean_x = self.multi_mean_x[net_id] if len(self.multi_mean_x) > net_id else 0.0
+        std_x = self.multi_std_x[net_id] if len(self.multi_std_x) > net_id else 1.0
+        return self.normalize_input(x, mean_x, std_x)
 
     ''' 计算 loss '''
 
@@ -472,10 +573,6 @@ class VGG16(base.NN):
         for i in range(times):
             batch_x, batch_y = data_set.next_batch(self.BATCH_SIZE)
 
-            mean_x = self.multi_mean_x[self.net_id] if len(self.multi_mean_x) > self.net_id else 0.0
-            std_x = self.multi_std_x[self.net_id] if len(self.multi_std_x) > self.net_id else 1.0
-
-            batch_x = (batch_x - mean_x) / (std_x + self.EPSILON)
             feed_dict = {self.__image: batch_x, self.__label: batch_y,
                          self.__size: batch_y.shape[0], self.keep_prob: 1.0,
                          self.t_is_train: False}
@@ -507,10 +604,6 @@ class VGG16(base.NN):
             if isinstance(batch_x, type(None)):
                 break
 
-            mean_x = self.multi_mean_x[self.net_id] if len(self.multi_mean_x) > self.net_id else 0.0
-            std_x = self.multi_std_x[self.net_id] if len(self.multi_std_x) > self.net_id else 1.0
-
-            batch_x = (batch_x - mean_x) / (std_x + self.EPSILON)
             feed_dict = {self.__image: batch_x, self.keep_prob: 1.0, self.t_is_train: False}
 
             prob = self.sess.run(self.__prob, feed_dict)
@@ -552,6 +645,7 @@ class VGG16(base.NN):
 
         # 生成训练的 op
         train_op = self.get_train_op(loss_regular, self.__learning_rate, self.global_step)
+        train_op = tf.group(train_op, self.t_input_update)  # 同时更新输入的 running mean / std
 
         self.__get_accuracy()
 
@@ -569,10 +663,6 @@ class VGG16(base.NN):
         # mean_train_ch_log_loss = 0
         mean_train_accuracy = 0
 
-        moment = 0.975
-        self.__running_mean = None
-        self.__running_std = None
-
         self.__train_set_list[self.net_id].start_thread()
         self.__val_set_list[self.net_id].start_thread()
 
@@ -603,15 +693,6 @@ class VGG16(base.NN):
 
             batch_x, batch_y = self.__train_set_list[self.net_id].next_batch(self.BATCH_SIZE)
 
-            reduce_axis = tuple(range(len(batch_x.shape) - 1))
-            _mean = np.mean(batch_x, axis=reduce_axis)
-            _std = np.std(batch_x, axis=reduce_axis)
-            self.__running_mean = moment * self.__running_mean + (1 - moment) * _mean if not isinstance(
-                self.__running_mean, type(None)) else _mean
-            self.__running_std = moment * self.__running_std + (1 - moment) * _std if not isinstance(
-                self.__running_std, type(None)) else _std
-            batch_x = (batch_x - _mean) / (_std + self.EPSILON)
-
             feed_dict = {self.__image: batch_x, self.__label: batch_y, self.keep_prob: self.KEEP_PROB,
                          self.__size: batch_y.shape[0], self.t_is_train: True}
 
@@ -625,9 +706,9 @@ class VGG16(base.NN):
 
             if step % self.__iter_per_epoch == 0 and step != 0:
                 epoch = int(step // self.__iter_per_epoch)
-                self.assign_list(self.multi_mean_x, self.net_id, self.__running_mean, 0.0)
-                self.assign_list(self.multi_std_x, self.net_id,
-                                 self.__running_std * (self.BATCH_SIZE / float(self.BATCH_SIZE - 1)), 1.0)
+                mean_x, std_x = self.commit_input_moments(self.BATCH_SIZE)
+                self.assign_list(self.multi_mean_x, self.net_id, mean_x, 0.0)
+                self.assign_list(self.multi_std_x, self.net_id, std_x, 1.0)
 
                 mean_train_accuracy /= self.__iter_per_epoch
                 mean_train_loss /= self.__iter_per_epoch
@@ -731,20 +812,88 @@ class VGG16(base.NN):
 
             # self.kill_tensorboard_if_runing()
 
-    def run(self):
+    ''' session 的配置；多进程训练时限制每个进程的线程数，避免 cpu 过载，并且 gpu 显存按需分配 '''
+
+    def __get_session_config(self):
+        intra_op_threads = self.INTRA_OP_THREADS
+        inter_op_threads = self.INTER_OP_THREADS
+        config = tf.ConfigProto()
+
+        if self.NUM_WORKERS > 1:
+            intra_op_threads = intra_op_threads or max(1, multiprocessing.cpu_count() // self.NUM_WORKERS)
+            inter_op_threads = inter_op_threads or 2
+            config.gpu_options.allow_growth = True
+
+        config.intra_op_parallelism_threads = intra_op_threads
+        config.inter_op_parallelism_threads = inter_op_threads
+        return config
+
+    ''' 训练第 net_id 个网络，返回该网络的结果 '''
+
+    def train_net(self, net_id):
         self.__result = []
 
-        # only_net = [2, 6]
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.run_i(net_id)
 
-        for i in range(self.NUM_PIG):
-            # if i not in only_net:
-            #     continue
+        return self.__result[-1]
 
-            self.graph = tf.Graph()
-            with self.graph.as_default():
-                self.run_i(i)
+    ''' 已经训练完的网络的结果 {net_id: 结果}；中断后重新运行时只训练还没完成的网络 '''
+
+    @staticmethod
+    def __load_progress(progress_path):
+        if not os.path.isfile(progress_path):
+            return {}
+
+        with open(progress_path, 'r') as f:
+            return {int(net_id): ret for net_id, ret in json.load(f).items()}
 
-            self.__show_result()
+    ''' 记录训练完的网络；先写临时文件再替换，避免中断时留下写了一半的文件 '''
+
+    def __save_progress(self, progress_path, progress, ret):
+        progress[int(ret[0])] = [int(ret[0])] + [float(value) for value in ret[1:]]
+
+        with open(progress_path + '.tmp', 'w') as f:
+            json.dump({str(net_id): ret for net_id, ret in progress.items()}, f)
+        if os.path.isfile(progress_path):
+            os.remove(progress_path)
+        os.rename(progress_path + '.tmp', progress_path)
+
+        self.echo('\n%d / %d nets finished ' % (len(progress), self.NUM_PIG))
+
+    '''
+     训练 30 个网络
+        NUM_WORKERS > 1 时用进程池同时训练多个网络 (python 3 用 spawn 启动子进程，每个子进程只训练一个网络)
+        每个网络训练完后记录到 <model_path>_progress.json；resume_time 为中断的那次运行的时间时，
+        继续使用它的模型路径，只训练还没完成的网络
+        全部训练完后统一展示结果
+    '''
+
+    def run(self, resume_time=''):
+        if resume_time:
+            model_dir = os.path.split(self.get_model_path())[0]
+            self.set_model_path(os.path.join(model_dir, '%s_%s' % (self.MODEL_NAME, resume_time)))
+
+        progress_path = '%s_progress.json' % self.get_model_path()
+        progress = self.__load_progress(progress_path)
+        todo_list = [i for i in range(self.NUM_PIG) if i not in progress]
+        self.echo('\n%d nets finished, %d nets to train ' % (len(progress), len(todo_list)))
+
+        # 从已有模型继续训练时会切换模型路径 (get_new_model)，只能在当前进程逐个训练
+        if self.NUM_WORKERS <= 1 or self.start_from_model:
+            for i in todo_list:
+                self.__save_progress(progress_path, progress, self.train_net(i))
+
+        else:
+            context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else None
+            task_list = [[self.get_model_path(), i] for i in todo_list]
+            for _, ret in imap_tasks(_train_net, task_list, self.NUM_WORKERS, chunk_size=1, context=context,
+                                     max_tasks_per_child=1):
+                self.__save_progress(progress_path, progress, ret)
+
+        self.__result = [progress[net_id] for net_id in sorted(progress)]
+        self.__show_result()
 
     ''' 展示保存的结果到 cmd '''
 
@@ -836,6 +985,75 @@ class VGG16(base.NN):
 
         self.echo('Finish testing ')
 
+    '''
+     建立包含 net_list (None 时为全部 30 个网络) 的 graph；返回 图片的 placeholder、主干输出的特征 (没有冻结主干时为 None)
+     self.__multi_prob 为这些网络的概率 (len(net_list), n)；冻结主干时 这些网络共用主干，可以直接 feed 缓存的特征 给 feature
+    '''
+
+    def __build_multi_head(self, net_list=None):
+        net_list = range(self.NUM_PIG) if net_list is None else net_list
+        self.echo('\nBuilding %d nets in one graph ... ' % len(net_list))
+
+        image = tf.placeholder(tf.uint8, self.IMAGE_PH_SHAPE, name='X')
+        self.keep_prob = tf.placeholder(tf.float32, name='keep_prob')
+        self.t_is_train = tf.placeholder(tf.bool, name='is_train')
+
+        feature = None
+        if self.USE_FROZEN_TRUNK:
+            info = self.__feature_store.get_info()
+            mean_x = np.array(info['mean_x'], np.float32)
+            std_x = np.array(info['std_x'], np.float32)
+            feature = self.__parse_trunk((tf.cast(image, tf.float32) - mean_x) / (std_x + self.EPSILON))
+
+        prob_list = []
+        for i in net_list:
+            self.net_id = i
+            self.restore_model_w_b()
+
+            x = feature if self.USE_FROZEN_TRUNK else image
+            with tf.name_scope('net_%d' % i):
+                output = self.parse_model_rebuild(self.__normalize(x, i))
+                prob = tf.nn.softmax(output)[:, 1]
+                prob_list.append(tf.maximum(tf.minimum(prob, 1 - 1e-15), 1e-15))
+
+        self.__multi_prob = tf.stack(prob_list)
+
+        self.sess = tf.Session(graph=self.graph, config=self.__get_session_config())
+        self.init_variables()
+
+        self.echo('Finish building ')
+        return image, feature
+
+    ''' 按 MULTI_HEAD_BATCH_SIZE 依次读取 data_set 的 x '''
+
+    def __iter_batch_x(self, data_set):
+        data_set.reset_cur_index()
+        while True:
+            batch = data_set.next_batch(self.MULTI_HEAD_BATCH_SIZE, False)
+            batch_x = batch[0] if isinstance(batch, tuple) else batch  # TestBData 只返回 x
+            if isinstance(batch_x, type(None)):
+                break
+            yield batch_x
+
+    '''
+     用同一个 graph 计算 graph 里的网络的概率 (网络数, n)；x 为 feed 数据的 tensor
+     batch_x_list 不为 None 时使用已经读取好的 batch，不再读取 data_set
+    '''
+
+    def __measure_multi_prob(self, data_set, x, batch_x_list=None):
+        times = int(math.ceil(float(data_set.get_size()) / self.MULTI_HEAD_BATCH_SIZE))
+        batch_x_list = self.__iter_batch_x(data_set) if batch_x_list is None else batch_x_list
+        prob_list = []
+
+        for count, batch_x in enumerate(batch_x_list):
+            feed_dict = {x: batch_x, self.keep_prob: 1.0, self.t_is_train: False}
+            prob_list.append(self.sess.run(self.__multi_prob, feed_dict))
+
+            progress = float(count + 1) / times * 100
+            self.echo('\r >> measuring progress: %.2f%% | %d \t' % (progress, times), False)
+
+        return np.hstack(prob_list)
+
     ''' 测试 '''
 
     def test(self):
@@ -844,23 +1062,39 @@ class VGG16(base.NN):
         self.__train_prob_list = []
         self.__val_prob_list = []
 
-        self.__train_data = load.TestData(0.0, self.TRAIN_DATA_RATIO, 'train', self.IMAGE_SHAPE)
-        self.__val_data = load.TestData(self.TRAIN_DATA_RATIO, self.VAL_DATA_END_RATIO, 'validation', self.IMAGE_SHAPE)
+        self.__train_data = load.TestData(0.0, self.TRAIN_DATA_RATIO, 'train', self.IMAGE_SHAPE,
+                                          self.__feature_store)
+        self.__val_data = load.TestData(self.TRAIN_DATA_RATIO, self.VAL_DATA_END_RATIO, 'validation', self.IMAGE_SHAPE,
+                                        self.__feature_store)
 
         self.echo('\nStart testing ... ')
-        for i in range(self.NUM_PIG):
-            self.echo('  testing %d net ... ' % i)
+        if self.USE_MULTI_HEAD:
+            if not self.USE_FROZEN_TRUNK:
+                raise ValueError('USE_MULTI_HEAD requires USE_FROZEN_TRUNK: without a frozen trunk there is no '
+                                 'shared trunk and every net would carry its own copy')
 
             self.graph = tf.Graph()
             with self.graph.as_default():
-                self.__test_i(i)
+                _, feature = self.__build_multi_head()
 
-            self.__show_result()
+                self.__train_prob_list = self.__measure_multi_prob(self.__train_data, feature)
+                self.__val_prob_list = self.__measure_multi_prob(self.__val_data, feature)
+                self.sess.close()
 
-        self.echo('Finish testing ')
+        else:
+            for i in range(self.NUM_PIG):
+                self.echo('  testing %d net ... ' % i)
+
+                self.graph = tf.Graph()
+                with self.graph.as_default():
+                    self.__test_i(i)
+
+                self.__show_result()
 
-        self.__train_prob_list = np.vstack(self.__train_prob_list)
-        self.__val_prob_list = np.vstack(self.__val_prob_list)
+            self.__train_prob_list = np.vstack(self.__train_prob_list)
+            self.__val_prob_list = np.vstack(self.__val_prob_list)
+
+        self.echo('Finish testing ')
 
         self.__train_prob_list = self.__np_softmax(self.__train_prob_list).transpose()
         self.__val_prob_list = self.__np_softmax(self.__val_prob_list).transpose()
@@ -879,8 +1113,60 @@ class VGG16(base.NN):
         self.echo('val_accuracy: %.6f val_log_loss: %.8f' % (val_accuracy, val_log_loss))
 
 
-# o_vgg = VGG16(False, '2018_01_12_01_38_40')
-# o_vgg.run()
+    '''
+     生成 data/Test_B 的识别结果 (RESULT_FILE_PATH)
+     冻结主干时 30 个网络建在同一个 graph 里 (共用主干)，只需要一个 graph、读取一次 Test_B
+     否则 30 个网络没有可以共用的部分，每个网络仍然各建一个 graph；Test_B 只读取一次 (全部放在内存里)，30 个网络共用
+    '''
+
+    def test_b(self):
+        test_b_data = load.TestBData(self.IMAGE_SHAPE)
+
+        if self.USE_FROZEN_TRUNK:
+            net_group = [None]
+            batch_x_list = None
+        else:
+            net_group = [[i] for i in range(self.NUM_PIG)]
+            batch_x_list = list(self.__iter_batch_x(test_b_data))
+
+        prob_list = []
+        for net_list in net_group:
+            self.graph = tf.Graph()
+            with self.graph.as_default():
+                image, _ = self.__build_multi_head(net_list)
+                prob_list.append(self.__measure_multi_prob(test_b_data, image, batch_x_list))
+                self.sess.close()
+
+        prob_list = self.__np_softmax(np.vstack(prob_list)).transpose()
+        pig_no_list = test_b_data.get_label_list()
+
+        if not os.path.isdir(self.RESULT_DIR):
+            os.mkdir(self.RESULT_DIR)
+
+        self.echo('\nSaving result to %s ... ' % self.RESULT_FILE_PATH)
+        with open(self.RESULT_FILE_PATH, 'w') as f:
+            writer = csv.writer(f)
+            for pig_no, predict_prob in zip(pig_no_list, prob_list):
+                for i, prob in enumerate(predict_prob):
+                    writer.writerow([pig_no, i + 1, '%.10f' % prob])
+
+        self.echo('Finish saving result ')
+
+
+''' 进程池的任务函数：在子进程里训练第 net_id 个网络；需要定义在模块层，才能被 pickle '''
+
+
+def _train_net(args):
+    model_path, net_id = args
+
+    o_vgg = VGG16(True)
+    o_vgg.set_model_path(model_path)
+    return o_vgg.train_net(net_id)
+
+
+if __name__ == '__main__':
+    # o_vgg = VGG16(False, '2018_01_12_01_38_40')
+    # o_vgg.run()
 
-o_vgg = VGG16(True, '2018_01_12_01_38_40')
-o_vgg.test()
+    o_vgg = VGG16(True, '2018_01_12_01_38_40')
+    o_vgg.test()
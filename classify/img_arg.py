@@ -5,6 +5,7 @@ import os
 import sys
 import copy
 import random
+import multiprocessing
 import numpy as np
 from PIL import Image
 from PIL import ImageEnhance
@@ -16,6 +17,10 @@ if cur_dir_path:
     sys.path.append(cur_dir_path)
     sys.path.append(os.path.split(cur_dir_path)[0])
 
+from lib.parallel import imap_tasks
+from lib.img import get_bbox
+from lib.dataset import PigIndex
+
 
 class Img:
     IMG_PATH = r'../data/TrainImg'
@@ -28,6 +33,14 @@ class Img:
 
     RESIZE_SIZE = [640, 360]
 
+    USE_PIG_INDEX = True  # 有 fcn/get_image.py 生成的索引 (TrainImg_pig.json) 时，直接用里面的 bbox 与 mask 裁剪原图
+
+    ONLY_ORIGIN = False  # 只生成 _0、_1 (load.Data 的 augment 为 True 时在加载时实时做 data argument，不需要其他图片)
+
+    NUM_WORKERS = multiprocessing.cpu_count()   # 并行生成图片的进程数；为 1 时在当前进程逐张处理
+    RANDOM_SEED = 0                             # 第 i 张图片使用的随机种子为 RANDOM_SEED + i；None 时不固定
+    CHUNK_SIZE = None                           # 每次分发给子进程的图片数；None 时自动计算
+
     def __init__(self):
         self.__img_list = []
         self.__alreadyList = {}
@@ -67,13 +80,23 @@ class Img:
     ''' 获取图片列表 '''
 
     def __get_img_list(self):
+        pig_index = PigIndex(self.IMG_PATH) if self.USE_PIG_INDEX else None
+        if pig_index is not None and pig_index.exist():
+            for stem in pig_index.get_list():
+                if '%s_pig.jpg' % stem in self.__alreadyList:
+                    continue
+                self.__img_list.append([os.path.join(self.IMG_PATH, '%s_pig.jpg' % stem), pig_index.get(stem)])
+
+            self.__progress_len = len(self.__img_list)
+            return
+
         for file_name in os.listdir(self.IMG_PATH):
             split_file_name = os.path.splitext(file_name)
             if split_file_name[1].lower() != '.jpg' or 'pig' not in split_file_name[0].lower() \
                     or file_name in self.__alreadyList:
                 continue
 
-            self.__img_list.append(os.path.join(self.IMG_PATH, file_name))
+            self.__img_list.append([os.path.join(self.IMG_PATH, file_name), None])
 
         # self.__progress_len = len(self.__img_list) * (self.NUM_TRANSFORM + self.NUM_BLOCK_IMAGE + self.NUM_CORP_IMAGE)
         self.__progress_len = len(self.__img_list)
@@ -82,82 +105,58 @@ class Img:
 
     @staticmethod
     def __get_pig_object(image):
-        np_image = np.array(image.convert('L'))
-        w, h = np_image.shape
-
-        min_w = -1
-        max_w = w
-        min_h = -1
-        max_h = h
-
-        for i in range(w):
-            for j in range(h):
-                if np_image[i][j] != 0:
-                    min_w = i
-                    break
-            if min_w >= 0:
-                break
-
-        for j in range(h):
-            for i in range(w):
-                if np_image[i][j] != 0:
-                    min_h = j
-                    break
-            if min_h >= 0:
-                break
-
-        for i in range(w):
-            for j in range(h):
-                if np_image[w - i - 1][j] != 0:
-                    max_w = w - i - 1
-                    break
-            if max_w < w:
-                break
-
-        for j in range(h):
-            for i in range(w):
-                if np_image[i][h - j - 1] != 0:
-                    max_h = h - j - 1
-                    break
-            if max_h < h:
-                break
-
-        min_w = max(min_w, 0)
-        min_h = max(min_h, 0)
-        max_w = min(max_w, w - 1)
-        max_h = min(max_h, h - 1)
+        min_w, max_w, min_h, max_h = get_bbox(np.array(image.convert('L')))
 
         np_image = np.array(image)
         np_pig = np_image[min_w: max_w + 1, min_h: max_h + 1, :]
 
         return Image.fromarray(np_pig), [min_w, max_w, min_h, max_h]
 
-    ''' 获取更多的图片 '''
+    '''
+     用索引的记录 (lib/dataset.py 的 PigIndex) 生成猪的图片；只解码一次原图，不需要读取 _pig.jpg、逐像素找 bbox
+     返回 (猪的图片, bbox, 框住猪的原图 (带背景) 的 np.array)
+    '''
+
+    @staticmethod
+    def __get_pig_from_index(frame_path, record):
+        min_w, max_w, min_h, max_h = pos = record['bbox']
+
+        np_frame_img = np.array(Image.open(frame_path).resize(record['size']))
+        np_frame_img = np_frame_img[min_w: max_w + 1, min_h: max_h + 1]
+
+        np_pig = np.expand_dims(PigIndex.get_mask(record), axis=2) * np_frame_img
+        return Image.fromarray(np_pig), pos, np_frame_img
+
+    ''' 获取更多的图片；供子进程调用，返回图片的名字；record 为索引里的记录，None 时读取 img_path (_pig.jpg) '''
 
-    def __get_more_img(self, img_path):
+    def get_more_img(self, img_path, record=None):
         im_name = os.path.splitext(os.path.split(img_path)[1])[0]
         im_name = im_name.replace('_pig', '')
+        frame_path = os.path.join(os.path.split(img_path)[0], '%s.jpg' % im_name)
         file_no = 0
 
-        self.__cal_progress(im_name)  # 输出进度
-
-        origin_image = Image.open(img_path)
-
         # 生成猪的原图
-        image, pos = self.__get_pig_object(origin_image)
+        if record is None:
+            image, pos = self.__get_pig_object(Image.open(img_path))
+            np_frame_img = None
+        else:
+            image, pos, np_frame_img = self.__get_pig_from_index(frame_path, record)
         image.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
         if pos[1] - pos[0] < 50 or pos[3] - pos[2] < 50:
-            return
+            return im_name
 
         # 生成能用最小的框框住猪的原图(带背景)
         file_no += 1
-        frame_img = Image.open(os.path.join(os.path.split(img_path)[0], '%s.jpg' % im_name))
-        np_frame_img = np.array(frame_img.resize(self.RESIZE_SIZE))
-        np_frame_img = np_frame_img[pos[0]: pos[1] + 1, pos[2]: pos[3] + 1]
+        if np_frame_img is None:
+            np_frame_img = np.array(Image.open(frame_path).resize(self.RESIZE_SIZE))
+            np_frame_img = np_frame_img[pos[0]: pos[1] + 1, pos[2]: pos[3] + 1]
         new_frame_img = Image.fromarray(np_frame_img)
         new_frame_img.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
+        if self.ONLY_ORIGIN:
+            return im_name
+
         # 水平翻转
         file_no += 1
         flip_image = image.transpose(Image.FLIP_LEFT_RIGHT)
@@ -242,6 +241,8 @@ class Img:
             file_no += 1
             corp_image.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
+        return im_name
+
     @staticmethod
     def __random_corp(np_image):
         w, h, c = np_image.shape
@@ -281,7 +282,7 @@ class Img:
         block_center_y - half_block_h: block_center_y + half_block_h, :] = np.array([0, 0, 0], np.int8)
         return block_image
 
-    ''' 获取进度 '''
+    ''' 获取进度；在主进程根据已完成的图片统计 '''
 
     def __cal_progress(self, img_name, increment=1):
         self.__progress_index += increment
@@ -310,12 +311,22 @@ class Img:
         self.echo('Finish getting img list ')
 
         self.echo('\nGetting more img ...')
-        for i, img_path in enumerate(self.__img_list):
-            self.__get_more_img(img_path)
-        self.echo('Finish getting more img ')
+        for _, im_name in imap_tasks(_get_more_img, self.__img_list, self.NUM_WORKERS, self.RANDOM_SEED,
+                                     self.CHUNK_SIZE):
+            self.__cal_progress(im_name)
+        self.echo('\nFinish getting more img ')
 
         self.echo('done')
 
 
-o_img = Img()
-o_img.run()
+''' 进程池的任务函数；需要定义在模块层，才能被 pickle '''
+
+
+def _get_more_img(task):
+    img_path, record = task
+    return Img().get_more_img(img_path, record)
+
+
+if __name__ == '__main__':
+    o_img = Img()
+    o_img.run()
@@ -0,0 +1,172 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import os
+import sys
+import json
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+# 将运行路径切换到当前文件所在路径
+cur_dir_path = os.path.abspath(os.path.split(__file__)[0])
+if cur_dir_path:
+    os.chdir(cur_dir_path)
+    sys.path.append(cur_dir_path)
+    sys.path.append(os.path.split(cur_dir_path)[0])
+
+from lib.dataset import FileIndex
+from lib.img import pad_image
+from lib.parallel import imap_tasks
+
+'''
+ 图片缓存: 将 补黑边 + resize 后的图片 (uint8) 保存在一个 .npy 文件里，加载数据时用 memmap 直接读取，不需要每个 epoch 重新解码
+    每个 (文件夹, resize, ratio) 一个缓存: CACHE_DIR/<文件夹名>_<w>x<h>_<ratio>.npy 以及同名的 .json (每一行对应的文件名、mtime)
+    图片的 mtime 与缓存里记录的不一致时视为没有缓存，加载数据时会直接解码图片
+    不缓存 _1 的图片 (加载数据时不会用到)
+ 建立缓存: 运行本文件 (按 RESIZE_LIST 用 NUM_WORKERS 个进程并行建立)，或 ImgCache.get(...).warm()
+ load.py、bi_load.py 的 USE_CACHE 为 True 时，若缓存存在则自动使用 (实时做 data argument 时不使用)
+'''
+
+
+class ImgCache:
+    CACHE_DIR = r'../data/cache'
+    DATA_ROOT = r'../data/TrainImgMore'
+    RATIO = 1.0
+    RESIZE_LIST = [[56, 56], [224, 224]]  # 运行本文件时建立缓存的 resize
+
+    NUM_WORKERS = multiprocessing.cpu_count()
+
+    __instances = {}
+
+    def __init__(self, data_root, resize, ratio=1.0):
+        self.__data_root = data_root
+        self.__resize = list(resize)
+        self.__ratio = ratio
+
+        name = '%s_%dx%d_%s' % (os.path.split(os.path.normpath(data_root))[1], resize[0], resize[1], ratio)
+        self.__npy_path = os.path.join(self.CACHE_DIR, name + '.npy')
+        self.__index_path = os.path.join(self.CACHE_DIR, name + '.json')
+
+        self.__images = None
+        self.__row = {}  # file_name -> [行号, mtime]
+
+        self.__open()
+
+    ''' 获取缓存；同一进程内共用 '''
+
+    @staticmethod
+    def get(data_root, resize, ratio=1.0):
+        key = (os.path.abspath(data_root), tuple(resize), ratio)
+        if key not in ImgCache.__instances:
+            ImgCache.__instances[key] = ImgCache(data_root, resize, ratio)
+        return ImgCache.__instances[key]
+
+    ''' 打开已有的缓存 '''
+
+    def __open(self):
+        self.__images = None
+        self.__row = {}
+        if not os.path.isfile(self.__npy_path) or not os.path.isfile(self.__index_path):
+            return
+
+        with open(self.__index_path, 'r') as f:
+            index = json.load(f)
+
+        self.__images = np.load(self.__npy_path, mmap_mode='r')
+        for i, file_name in enumerate(index['file_list']):
+            self.__row[file_name] = [i, index['mtime_list'][i]]
+
+    ''' 缓存是否存在 '''
+
+    def exist(self):
+        return self.__images is not None
+
+    ''' 获取缓存的图片；没有缓存或图片有变化时返回 None '''
+
+    def lookup(self, img_path):
+        record = self.__row.get(os.path.split(img_path)[1])
+        if record is None:
+            return None
+
+        try:
+            if os.stat(img_path).st_mtime != record[1]:
+                return None
+        except OSError:
+            return None
+
+        return self.__images[record[0]]
+
+    ''' 建立 / 更新缓存；没有变化的图片直接从旧缓存复制，只解码新增或有变化的图片 '''
+
+    def warm(self, num_workers=None):
+        if not os.path.isdir(self.CACHE_DIR):
+            os.makedirs(self.CACHE_DIR)
+
+        file_list = [file_name for _, file_name, no_list in FileIndex.get(self.__data_root).get_list()
+                     if no_list[-1] != '1']
+        mtime_list = [os.stat(os.path.join(self.__data_root, file_name)).st_mtime for file_name in file_list]
+        file_len = len(file_list)
+        w, h = self.__resize
+
+        tmp_path = self.__npy_path + '.tmp'
+        images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(file_len, h, w, 3))
+
+        todo_list = []
+        for i, file_name in enumerate(file_list):
+            record = self.__row.get(file_name)
+            if record and record[1] == mtime_list[i]:
+                images[i] = self.__images[record[0]]
+            else:
+                todo_list.append(i)
+
+        task_list = [[os.path.join(self.__data_root, file_list[i]), self.__resize, self.__ratio] for i in todo_list]
+        for done_num, (index, np_image) in enumerate(imap_tasks(_pad_image, task_list, num_workers)):
+            images[todo_list[index]] = np_image
+            self.echo('\r >> warming %s: %.2f%% \t' % (self.__npy_path, float(done_num + 1) / len(todo_list) * 100),
+                      False)
+
+        images.flush()
+        del images
+        self.__images = None  # 关闭旧的 memmap，才能替换文件
+
+        if os.path.isfile(self.__npy_path):
+            os.remove(self.__npy_path)
+        os.rename(tmp_path, self.__npy_path)
+
+        with open(self.__index_path + '.tmp', 'w') as f:
+            json.dump({'file_list': file_list, 'mtime_list': mtime_list}, f)
+        if os.path.isfile(self.__index_path):
+            os.remove(self.__index_path)
+        os.rename(self.__index_path + '.tmp', self.__index_path)
+
+        self.__open()
+        self.echo('\n%s: %d images (%d decoded)' % (self.__npy_path, file_len, len(todo_list)))
+
+    ''' 输出展示 '''
+
+    @staticmethod
+    def echo(msg, crlf=True):
+        if crlf:
+            print(msg)
+        else:
+            sys.stdout.write(msg)
+            sys.stdout.flush()
+
+    @staticmethod
+    def run():
+        for resize in ImgCache.RESIZE_LIST:
+            ImgCache.get(ImgCache.DATA_ROOT, resize, ImgCache.RATIO).warm(ImgCache.NUM_WORKERS)
+        ImgCache.echo('done')
+
+
+''' 进程池的任务函数；需要定义在模块层，才能被 pickle '''
+
+
+def _pad_image(args):
+    img_path, resize, ratio = args
+    return pad_image(Image.open(img_path), resize, ratio)
+
+
+if __name__ == '__main__':
+    ImgCache.run()
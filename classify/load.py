@@ -14,7 +14,12 @@ if '2.7' in sys.version:
     import Queue as queue
 else:
     import queue
-import time
+
+# lib 在上一级目录
+sys.path.append(os.path.split(os.path.abspath(os.path.split(__file__)[0]))[0])
+from lib.img import random_augment, pad_image
+from lib.dataset import FileIndex
+from img_cache import ImgCache
 
 '''
     下载数据
@@ -116,6 +121,32 @@ class Download:
         print('done')
 
 
+'''
+ 按原图分组的文件列表 [[[stem, file_path, arg_no], ...], ...]；'3_12_0.jpg'、'3_12_2.jpg' ... 为同一张原图 '3_12'
+ 组的顺序为原图第一次出现的顺序 (与 FileIndex 的文件顺序一致)；不包含 _1 的图片
+ 结果缓存在 FileIndex 里，训练集、校验集共用，只计算一次；不要修改返回的结果
+'''
+
+
+def get_source_group(data_root):
+    def __group(file_list):
+        group_dict = {}
+        group_list = []
+        for stem, file_name, no_list in file_list:
+            arg_no = int(no_list[-1])
+            if arg_no == 1:
+                continue
+
+            source = tuple(no_list[:-1])
+            if source not in group_dict:
+                group_dict[source] = []
+                group_list.append(group_dict[source])
+            group_dict[source].append([stem, os.path.join(data_root, file_name), arg_no])
+        return group_list
+
+    return FileIndex.get(data_root).memoize('source_group', __group)
+
+
 class Data:
     DATA_ROOT = r'../data/TrainImgMore'
     RESIZE = [224, 224]
@@ -123,28 +154,33 @@ class Data:
     RATIO = 1.0
     NUM_CLASSES = 30
 
-    def __init__(self, start_ratio=0.0, end_ratio=1.0, name='', resize=None):
+    NUM_WORKERS = 4  # 后台解码图片、组装 batch 的线程数
+    PREFETCH_BATCHES = 8  # 提前准备好的 batch 数量上限
+    USE_CACHE = True  # 有 img_cache.py 建立的图片缓存时直接读取缓存，不再解码图片
+
+    ''' augment 为 True 时只加载猪的原图 (_0)，在加载时实时随机做 data argument (与 img_arg.py 生成的图片同分布) '''
+
+    def __init__(self, start_ratio=0.0, end_ratio=1.0, name='', resize=None, augment=False):
         self.__chang_dir()
 
         # 初始化变量
         self.__name = name
         self.__data = []
         self.__resize = resize if resize else self.RESIZE
+        self.__augment = augment
 
-        # 加载全部数据
-        self.__load()
-        self.__data_len = len(self.__data)
+        # 实时做 data argument 时需要原图，不使用缓存
+        self.__cache = ImgCache.get(self.DATA_ROOT, self.__resize, self.RATIO) \
+            if self.USE_CACHE and not augment else None
+        if self.__cache and not self.__cache.exist():
+            self.__cache = None
 
         # 检查输入参数
         start_ratio = min(max(0.0, start_ratio), 1.0)
         end_ratio = min(max(0.0, end_ratio), 1.0)
 
-        # 根据比例计算数据的位置范围
-        start_index = int(self.__data_len * start_ratio)
-        end_index = int(self.__data_len * end_ratio)
-
-        # 根据数据的位置范围 取数据
-        self.__data = self.__data[start_index: end_index]
+        # 按比例加载数据
+        self.__load(start_ratio, end_ratio)
 
         # 取 scale 分之一的数据
         # scale = 3
@@ -157,9 +193,16 @@ class Data:
         self.__data_len = len(self.__data)
         random.shuffle(self.__data)
 
-        self.__queue = queue.Queue()
+        self.__task_queue = queue.Queue()  # 每个任务为 [batch_size, 一个 batch 的样本位置]
+        self.__batch_queue = queue.Queue(self.PREFETCH_BATCHES)  # 组装好的 batch 在 ring 里的位置
+        self.__ring = {}  # batch_size -> [X 的 buffer, label 的 buffer, 空闲 buffer 的 queue]
+        self.__ring_lock = threading.Lock()
+        self.__last_batch = None  # 上一次 next_batch 返回的 [batch_size, buffer 的位置]；下一次调用时归还
+        self.__one_hot = np.eye(self.NUM_CLASSES, dtype=np.float32)
+        self.__thread_list = []
         self.__stop_thread = False
-        self.__thread = None
+        self.__batch_size = 0
+        self.__in_flight = 0  # 已提交但还没被 next_batch 取走的 batch 数
 
         self.__cur_index = 0
 
@@ -171,58 +214,148 @@ class Data:
             os.chdir(cur_dir_path)
             sys.path.append(cur_dir_path)
 
-    ''' 加载数据 '''
+    '''
+     加载数据；按原图分组 (source_group) 后再根据比例划分，同一张原图生成的图片只会出现在同一个数据集里
+     augment 为 True 时，划分后只保留原图 (_0)；训练集、校验集的划分与 augment 无关
+    '''
 
-    def __load(self):
+    def __load(self, start_ratio, end_ratio):
         self.echo('Loading %s data ...' % self.__name)
-        file_list = os.listdir(self.DATA_ROOT)
-        file_len = len(file_list)
 
-        for i, file_name in enumerate(file_list):
-            progress = float(i + 1) / file_len * 100
-            self.echo('\r >> progress: %.2f%% \t' % progress, False)
+        group_list = get_source_group(self.DATA_ROOT)
+        group_len = len(group_list)
 
-            split_file_name = os.path.splitext(file_name)
-            no_list = split_file_name[0].split('_')
+        # 根据比例计算数据的位置范围 (以原图为单位)
+        start_index = int(group_len * start_ratio)
+        end_index = int(group_len * end_ratio)
+
+        for group in group_list[start_index: end_index]:
+            for stem, img_path, arg_no in group:
+                # 实时做 data argument 时，不需要预先生成的图片
+                if self.__augment and arg_no != 0:
+                    continue
+
+                self.__data.append([stem, img_path])
+
+        self.echo('Finish Loading\n')
+
+    '''
+     获取 batch_size 对应的 ring buffer；没有时分配
+     共 PREFETCH_BATCHES + 1 个 buffer (最多 PREFETCH_BATCHES 个在准备中，1 个在被使用)，循环使用，不需要每个 batch 重新分配
+    '''
+
+    def __get_ring(self, batch_size):
+        with self.__ring_lock:
+            if batch_size not in self.__ring:
+                ring_size = self.PREFETCH_BATCHES + 1
+                X = np.zeros([ring_size, batch_size, self.__resize[1], self.__resize[0], 3], np.uint8)
+                label = np.zeros([ring_size, batch_size], np.int32)
+
+                free_queue = queue.Queue()
+                for i in range(ring_size):
+                    free_queue.put(i)
 
-            if split_file_name[1].lower() != '.jpg' or int(no_list[-1]) == 1:
+                self.__ring[batch_size] = [X, label, free_queue]
+            return self.__ring[batch_size]
+
+    ''' 后台线程：取任务，解码图片直接写入空闲的 buffer；出错时把异常交给 next_batch 抛出 '''
+
+    def __worker(self):
+        while True:
+            task = self.__task_queue.get()
+            if task is None:
+                break
+
+            batch_size, index_list = task
+            X, label, free_queue = self.__get_ring(batch_size)
+            buffer_index = free_queue.get()
+
+            try:
+                for i, data_index in enumerate(index_list):
+                    file_name, img_path = self.__data[data_index]
+                    X[buffer_index, i], label[buffer_index, i] = self.__get_x_y(img_path)
+            except Exception as e:
+                free_queue.put(buffer_index)
+                self.__batch_queue.put(e)
                 continue
 
-            self.__data.append([split_file_name[0], os.path.join(self.DATA_ROOT, file_name)])
+            self.__batch_queue.put([batch_size, buffer_index])
 
-        self.echo('\nFinish Loading\n')
+    ''' 提交一个 batch 的任务 '''
 
-    def __get_data(self):
-        max_q_size = min(self.__data_len, 500)
-        while not self.__stop_thread:
-            while self.__queue.qsize() <= max_q_size:
-                file_name, img_path = self.__data[self.__cur_index]
-                x, y = self.__get_x_y(img_path)
+    def __submit(self):
+        index_list = [(self.__cur_index + i) % self.__data_len for i in range(self.__batch_size)]
+        self.__cur_index = (self.__cur_index + self.__batch_size) % self.__data_len
 
-                self.__queue.put([x, y])
-                self.__cur_index = (self.__cur_index + 1) % self.__data_len
+        self.__task_queue.put([self.__batch_size, index_list])
+        self.__in_flight += 1
 
-            time.sleep(0.3)
+    ''' 归还 buffer '''
 
-        self.echo(
-            '\n*************************************\n Thread "get_%s_data" stop\n***********************\n' % self.__name)
+    def __release(self, batch_size, buffer_index):
+        self.__get_ring(batch_size)[2].put(buffer_index)
+
+    ''' 启动后台线程；传入 batch_size 时立即开始准备数据，否则在第一次 next_batch 时开始 '''
+
+    def start_thread(self, batch_size=None):
+        self.__stop_thread = False
+        for i in range(self.NUM_WORKERS):
+            thread = threading.Thread(target=self.__worker, name=('get_%s_data_%d' % (self.__name, i)))
+            thread.daemon = True
+            thread.start()
+            self.__thread_list.append(thread)
+
+        if batch_size:
+            self.__batch_size = batch_size
+            while self.__in_flight < self.PREFETCH_BATCHES:
+                self.__submit()
 
-    def start_thread(self):
-        self.__thread = threading.Thread(target=self.__get_data, name=('get_%s_data' % self.__name))
-        self.__thread.start()
         self.echo('Thread "get_%s_data" is running ... ' % self.__name)
 
+    ''' 停止后台线程，并等待线程结束 '''
+
     def stop(self):
         self.__stop_thread = True
+        if not self.__thread_list:
+            return
+
+        # 丢弃还没开始处理的任务，让后台线程尽快结束
+        try:
+            while True:
+                self.__task_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        for _ in self.__thread_list:
+            self.__task_queue.put(None)
+        for thread in self.__thread_list:
+            thread.join()
+
+        self.__thread_list = []
+        self.__in_flight = 0
+        self.__batch_queue = queue.Queue(self.PREFETCH_BATCHES)
+        self.__ring = {}
+        self.__last_batch = None
+
+        self.echo(
+            '\n*************************************\n Thread "get_%s_data" stop\n***********************\n' % self.__name)
+
+    ''' 返回 uint8 的图片 与 int 的 label (猪的编号 - 1) '''
 
     def __get_x_y(self, img_path):
         no_list = os.path.splitext(os.path.split(img_path)[1])[0].split('_')
-
         pig_no = int(no_list[0]) - 1
-        label = np.zeros([Data.NUM_CLASSES])
-        label[pig_no] = 1
 
-        return self.add_padding(img_path), label
+        if self.__cache:
+            np_image = self.__cache.lookup(img_path)
+            if np_image is not None:
+                return np_image, pig_no
+
+        image = Image.open(img_path)
+        if self.__augment:
+            image = random_augment(image)
+
+        return self.__pad_image(image), pig_no
 
     # @staticmethod
     # def __read_img_list(img_list):
@@ -267,44 +400,50 @@ class Data:
         return np.array(Image.fromarray(np_image).resize(self.__resize), dtype=np.float32)
 
     def add_padding(self, img_path):
-        image = Image.open(img_path)
-        w, h = image.size
-        ratio = float(w) / h
+        return self.__pad_image(Image.open(img_path))
 
-        if abs(ratio - Data.RATIO) <= 0.1:
-            return np.array(image.resize(self.__resize))
+    ''' 将图片补成 RATIO 的比例 (补黑边) 再 resize；与图片缓存使用同一个函数 '''
 
-        np_image = np.array(image)
-        h, w, c = np_image.shape
+    def __pad_image(self, image):
+        return pad_image(image, self.__resize, Data.RATIO)
 
-        if ratio > Data.RATIO:
-            new_h = int(float(w) / Data.RATIO)
-            padding = int((new_h - h) / 2.0)
+    '''
+     获取下个 batch；阻塞等待后台线程组装好的 batch
+     X 为 uint8，直接是 ring buffer 里的数组 (不复制)，在下一次调用 next_batch 之前有效
+     one_hot 为 True 时 y 为 float32 的 one-hot，否则为 int 的 label
+    '''
 
-            np_new_image = np.zeros([new_h, w, c])
-            np_new_image[padding: padding + h, :, :] = np_image
+    def next_batch(self, batch_size, one_hot=True):
+        if not self.__thread_list:
+            self.start_thread()
 
-        else:
-            new_w = int(float(h) * Data.RATIO)
-            padding = int((new_w - w) / 2.0)
-
-            np_new_image = np.zeros([h, new_w, c])
-            np_new_image[:, padding: padding + w, :] = np_image
-
-        new_image = Image.fromarray(np.cast['uint8'](np_new_image))
-        return np.array(new_image.resize(self.__resize))
-
-    def next_batch(self, batch_size):
-        X = []
-        y = []
-        for i in range(batch_size):
-            while self.__queue.empty():
-                time.sleep(0.2)
-            if not self.__queue.empty():
-                _x, _y = self.__queue.get()
-                X.append(_x)
-                y.append(_y)
-        return np.array(X), np.array(y)
+        # 上一个 batch 已经用完，归还 buffer
+        if self.__last_batch:
+            self.__release(*self.__last_batch)
+            self.__last_batch = None
+
+        # batch_size 变化时，已提交的旧大小的 batch 会被丢弃
+        self.__batch_size = batch_size
+
+        while True:
+            while self.__in_flight < self.PREFETCH_BATCHES:
+                self.__submit()
+
+            batch = self.__batch_queue.get()
+            self.__in_flight -= 1
+
+            if isinstance(batch, Exception):
+                raise batch
+
+            _batch_size, buffer_index = batch
+            if _batch_size != batch_size:
+                self.__release(_batch_size, buffer_index)
+                continue
+
+            X, label, _ = self.__get_ring(batch_size)
+            self.__last_batch = batch
+            y = label[buffer_index]
+            return X[buffer_index], self.__one_hot[y] if one_hot else y.copy()
 
     # ''' 获取下个 batch '''
     # def next_batch(self, batch_size, loop = True):
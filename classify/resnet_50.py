@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-import numpy as np
 import tensorflow as tf
 
 # 将运行路径切换到当前文件所在路径
@@ -43,6 +42,7 @@ class Resnet(base.NN):
 
     USE_BN = True  # 网络里是否使用了 batch normalize
     USE_BN_INPUT = True  # 输入是否使用 batch normalize
+    USE_AUGMENT = False  # 训练集是否在加载时实时做 data argument (此时 img_arg.py 只需要生成 _0、_1 图片)
     USE_CONV_STDDEV = True  # init_weight 是否使用 CONV_WEIGHT_STDDEV
 
     SHOW_PROGRESS_FREQUENCY = 10  # 每 SHOW_PROGRESS_FREQUENCY 个 step show 一次进度 progress
@@ -210,7 +210,7 @@ class Resnet(base.NN):
         self.__steps = self.EPOCH_TIMES * self.__iter_per_epoch
 
         # 输入 与 label
-        self.__image = tf.placeholder(tf.float32, self.IMAGE_PH_SHAPE, name='X')
+        self.__image = tf.placeholder(tf.uint8, self.IMAGE_PH_SHAPE, name='X')  # 直接 feed uint8 的图片
         self.__label = tf.placeholder(tf.float32, [None, self.NUM_CLASSES], name='y')
         self.__size = tf.placeholder(tf.float32, name='size')
 
@@ -228,11 +228,11 @@ class Resnet(base.NN):
 
     def load(self):
         # sort_list = load.Data.get_sort_list()
-        self.__train_set = load.Data(0.0, 0.64, 'train')
+        self.__train_set = load.Data(0.0, 0.64, 'train', augment=self.USE_AUGMENT)
         # self.__val_set = load.Data(0.9, 1.0, 'validation')
         # self.__test_set = load.Data(0.8, 1.0, 'test')
 
-        self.__train_set.start_thread()
+        self.__train_set.start_thread(self.BATCH_SIZE)
         # self.__val_set.start_thread()
 
         self.__train_size = self.__train_set.get_size()
@@ -242,7 +242,7 @@ class Resnet(base.NN):
     ''' 模型 '''
 
     def model(self):
-        self.__output = self.parse_model(self.__image)
+        self.__output = self.parse_model(self.normalize_input(self.__image))
 
     # ''' 重建模型 '''
     # def rebuild_model(self):
@@ -329,6 +329,7 @@ class Resnet(base.NN):
         # 生成训练的 op
         # train_op = self.get_train_op(self.__log_loss, self.__learning_rate, self.global_step)
         train_op = self.get_train_op(self.__loss, self.__learning_rate, self.global_step)
+        train_op = tf.group(train_op, self.t_input_update)  # 同时更新输入的 running mean / std
 
         self.__get_accuracy()
 
@@ -349,10 +350,6 @@ class Resnet(base.NN):
 
         self.echo('\nepoch:')
 
-        moment = 0.975
-        self.__running_mean = None
-        self.__running_std = None
-
         for step in range(self.__steps):
             if step % self.SHOW_PROGRESS_FREQUENCY == 0:
                 epoch_progress = float(step) % self.__iter_per_epoch / self.__iter_per_epoch * 100.0
@@ -362,15 +359,6 @@ class Resnet(base.NN):
 
             batch_x, batch_y = self.__train_set.next_batch(self.BATCH_SIZE)
 
-            reduce_axis = tuple(range(len(batch_x.shape) - 1))
-            _mean = np.mean(batch_x, axis=reduce_axis)
-            _std = np.std(batch_x, axis=reduce_axis)
-            self.__running_mean = moment * self.__running_mean + (1 - moment) * _mean if not isinstance(
-                self.__running_mean, type(None)) else _mean
-            self.__running_std = moment * self.__running_std + (1 - moment) * _std if not isinstance(
-                self.__running_std, type(None)) else _std
-            batch_x = (batch_x - _mean) / (_std + self.EPSILON)
-
             feed_dict = {self.__image: batch_x, self.__label: batch_y, self.keep_prob: self.KEEP_PROB,
                          self.__size: batch_y.shape[0], self.t_is_train: True}
             _, train_loss, train_accuracy = self.sess.run([train_op, self.__loss, self.__accuracy], feed_dict)
@@ -380,8 +368,7 @@ class Resnet(base.NN):
 
             if step % self.__iter_per_epoch == 0 and step != 0:
                 epoch = int(step // self.__iter_per_epoch)
-                self.mean_x = self.__running_mean
-                self.std_x = self.__running_std * (self.BATCH_SIZE / float(self.BATCH_SIZE - 1))
+                self.mean_x, self.std_x = self.commit_input_moments(self.BATCH_SIZE)
 
                 mean_train_accuracy /= self.__iter_per_epoch
                 mean_train_loss /= self.__iter_per_epoch
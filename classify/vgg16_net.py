@@ -46,6 +46,8 @@ class VGG16(base.NN):
 
     USE_BN = True  # 网络里是否使用了 batch normalize
     USE_BN_INPUT = True  # 输入是否使用 batch normalize
+    USE_AUGMENT = False  # 训练集是否在加载时实时做 data argument (此时 img_arg.py 只需要生成 _0、_1 图片)
+    USE_FROZEN_GRAPH = True  # 训练结束后导出冻结的推理图 (.pb)；use_model 直接加载 .pb (没有时先导出)，不需要重建模型
 
     SHOW_PROGRESS_FREQUENCY = 2  # 每 SHOW_PROGRESS_FREQUENCY 个 step show 一次进度 progress
 
@@ -246,7 +248,7 @@ class VGG16(base.NN):
         self.__steps = self.EPOCH_TIMES * self.__iter_per_epoch
 
         # 输入 与 label
-        self.__image = tf.placeholder(tf.float32, self.IMAGE_PH_SHAPE, name='X')
+        self.__image = tf.placeholder(tf.uint8, self.IMAGE_PH_SHAPE, name='X')  # 直接 feed uint8 的图片
         self.__label = tf.placeholder(tf.float32, [None, self.NUM_CLASSES], name='y')
         self.__size = tf.placeholder(tf.float32, name='size')
 
@@ -260,15 +262,19 @@ class VGG16(base.NN):
 
         self.__has_rebuild = False
 
+        # 冻结的推理图的 输入、输出 (USE_FROZEN_GRAPH 时 use_model 使用)
+        self.__frozen_input = None
+        self.__frozen_output = None
+
     ''' 加载数据 '''
 
     def load(self):
-        self.__train_set = load.Data(0.0, 0.8, 'train')
+        self.__train_set = load.Data(0.0, 0.8, 'train', augment=self.USE_AUGMENT)
         self.__val_set = load.Data(0.8, 1.0, 'validation')
         # self.__test_set = load.Data(0.8, 1.0, 'test')
 
-        self.__train_set.start_thread()
-        self.__val_set.start_thread()
+        self.__train_set.start_thread(self.BATCH_SIZE)
+        self.__val_set.start_thread(self.BATCH_SIZE)
 
         self.__train_size = self.__train_set.get_size()
         self.__val_size = self.__val_set.get_size()
@@ -277,12 +283,12 @@ class VGG16(base.NN):
     ''' 模型 '''
 
     def model(self):
-        self.__output = self.parse_model(self.__image)
+        self.__output = self.parse_model(self.normalize_input(self.__image))
 
     ''' 重建模型 '''
 
     def rebuild_model(self):
-        self.__output = self.parse_model_rebuild(self.__image)
+        self.__output = self.parse_model_rebuild(self.normalize_input(self.__image))
 
     ''' 计算 loss '''
 
@@ -350,8 +356,6 @@ class VGG16(base.NN):
         for i in range(times):
             batch_x, batch_y = data_set.next_batch(self.BATCH_SIZE)
 
-            batch_x = (batch_x - self.mean_x) / (self.std_x + self.EPSILON)
-
             feed_dict = {self.__image: batch_x, self.__label: batch_y,
                          self.__size: batch_y.shape[0], self.keep_prob: 1.0,
                          self.t_is_train: False}
@@ -388,6 +392,7 @@ class VGG16(base.NN):
 
         # 生成训练的 op
         train_op = self.get_train_op(self.__ch_loss_regular, self.__learning_rate, self.global_step)
+        train_op = tf.group(train_op, self.t_input_update)  # 同时更新输入的 running mean / std
 
         self.__get_accuracy()
 
@@ -410,10 +415,6 @@ class VGG16(base.NN):
 
         self.echo('\nepoch:')
 
-        moment = 0.975
-        self.__running_mean = None
-        self.__running_std = None
-
         for step in range(self.__steps):
             if step % self.SHOW_PROGRESS_FREQUENCY == 0:
                 epoch_progress = float(step) % self.__iter_per_epoch / self.__iter_per_epoch * 100.0
@@ -423,15 +424,6 @@ class VGG16(base.NN):
 
             batch_x, batch_y = self.__train_set.next_batch(self.BATCH_SIZE)
 
-            reduce_axis = tuple(range(len(batch_x.shape) - 1))
-            _mean = np.mean(batch_x, axis=reduce_axis)
-            _std = np.std(batch_x, axis=reduce_axis)
-            self.__running_mean = moment * self.__running_mean + (1 - moment) * _mean if type(
-                self.__running_mean) != type(None) else _mean
-            self.__running_std = moment * self.__running_std + (1 - moment) * _std if type(self.__running_std) != type(
-                None) else _std
-            batch_x = (batch_x - _mean) / (_std + self.EPSILON)
-
             feed_dict = {self.__image: batch_x, self.__label: batch_y, self.keep_prob: self.KEEP_PROB,
                          self.__size: batch_y.shape[0], self.t_is_train: True}
             _, train_loss, train_log_loss, train_ch_log_loss, train_accuracy = self.sess.run(
@@ -444,8 +436,7 @@ class VGG16(base.NN):
 
             if step % self.__iter_per_epoch == 0 and step != 0:
                 epoch = int(step // self.__iter_per_epoch)
-                self.mean_x = self.__running_mean
-                self.std_x = self.__running_std * (self.BATCH_SIZE / float(self.BATCH_SIZE - 1))
+                self.mean_x, self.std_x = self.commit_input_moments(self.BATCH_SIZE)
 
                 mean_train_accuracy /= self.__iter_per_epoch
                 mean_train_loss /= self.__iter_per_epoch
@@ -468,8 +459,6 @@ class VGG16(base.NN):
                                                                                                       100)
                 batch_val_x, batch_val_y = self.__val_set.next_batch(self.BATCH_SIZE)
 
-                batch_val_x = (batch_val_x - self.mean_x) / (self.std_x + self.EPSILON)
-
                 feed_dict = {self.__image: batch_val_x, self.__label: batch_val_y, self.keep_prob: 1.0,
                              self.__size: batch_val_y.shape[0], self.__mean_accuracy: mean_val_accuracy,
                              self.__mean_loss: mean_val_loss, self.__mean_log_loss: mean_val_log_loss,
@@ -514,6 +503,9 @@ class VGG16(base.NN):
         # self.__test_set.start_thread()
 
         self.restore_model_w_b()  # 恢复模型
+        if self.USE_FROZEN_GRAPH:
+            self.export_frozen_graph(self.IMAGE_PH_SHAPE[1:])  # 导出冻结的推理图，给 use_model 使用
+
         self.rebuild_model()  # 重建模型
         self.get_loss()  # 重新 get loss
         self.__get_accuracy()
@@ -539,7 +531,26 @@ class VGG16(base.NN):
 
         self.echo('\ndone')
 
+    ''' 加载冻结的推理图；只需要一次 import_graph_def，不需要 restore 变量、重建模型 '''
+
+    def __load_frozen_graph(self):
+        pb_path = self.get_frozen_graph_path()
+        if not os.path.isfile(pb_path):
+            self.export_frozen_graph(self.IMAGE_PH_SHAPE[1:], pb_path)
+
+        graph, self.__frozen_input, self.__frozen_output = self.load_frozen_graph(pb_path)
+
+        self.sess.close()
+        self.sess = tf.Session(graph=graph)
+
     def use_model(self, np_image):
+        if self.USE_FROZEN_GRAPH:
+            if self.__frozen_output is None:
+                self.__load_frozen_graph()
+
+            np_image = np.expand_dims(np_image, axis=0).astype(np.float32)
+            return self.sess.run(self.__frozen_output, {self.__frozen_input: np_image})[0]
+
         if not self.__has_rebuild:
             self.restore_model_w_b()  # 恢复模型
             self.rebuild_model()  # 重建模型
@@ -552,8 +563,6 @@ class VGG16(base.NN):
 
         np_image = np.expand_dims(np_image, axis=0)
 
-        np_image = (np_image - self.mean_x) / (self.std_x + self.EPSILON)
-
         feed_dict = {self.__image: np_image, self.keep_prob: 1.0, self.t_is_train: False}
         output = self.sess.run(self.__output, feed_dict)
 
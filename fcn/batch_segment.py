@@ -0,0 +1,160 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import os
+import sys
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from PIL import Image
+
+# 将运行路径切换到当前文件所在路径
+cur_dir_path = os.path.abspath(os.path.split(__file__)[0])
+if cur_dir_path:
+    os.chdir(cur_dir_path)
+    sys.path.append(cur_dir_path)
+    sys.path.append(os.path.split(cur_dir_path)[0])
+
+import fcn
+from lib.dataset import PigIndex
+
+'''
+ 批量分割图片 (get_image.py、get_test_image.py 共用)
+    NUM_DECODE_THREADS 个线程在后台解码、resize 下一组 (PREFETCH_IMAGES 张) 图片
+    大小相同的图片组成一个 batch，每个 batch 一次 sess.run；batch 的像素总数不超过 MAX_BATCH_PIXELS (控制内存)
+    NUM_WORKERS 个进程并行做后处理 (mask -> 猪的图片) 并保存；
+        进程池在构造 BatchSegment 时创建，需要在创建 FCN (TF 的 session) 之前构造，避免子进程 fork 正在运行的 TF
+        进程池在 run 结束时关闭，一个 BatchSegment 只能 run 一次
+    pig_index (lib/dataset.py 的 PigIndex) 不为 None 时，同时把每张图的 bbox 与裁剪后的 mask (RLE) 记录到索引里
+ 用法:
+    segment = BatchSegment()  # 在 fcn.FCN(...) 之前
+    o_fcn = fcn.FCN(...)
+    segment.run(o_fcn, task_list, resize_func, pig_index)
+    task_list 为 [[img_path, save_path], ...]；save_path 为 None 时不保存猪的图片 (只记录索引)
+    resize_func(image) 返回 resize 后的 np.array
+'''
+
+
+class BatchSegment:
+    MAX_BATCH_PIXELS = 640 * 360 * 8  # 一个 batch 的像素总数上限 (640 * 360 的图片每个 batch 8 张)
+    PREFETCH_IMAGES = 64  # 每次提前解码的图片数
+    MAX_PENDING = 64  # 等待后处理的图片数上限
+
+    NUM_DECODE_THREADS = 4  # 解码图片的线程数
+    NUM_WORKERS = multiprocessing.cpu_count()  # 后处理的进程数
+
+    def __init__(self):
+        self.__done_num = 0
+        self.__task_len = 0
+        self.__records = {}
+
+        # 后处理的进程池；此时还没有 TF 的 session，fork 出的子进程里没有 TF 的运行时
+        self.__post_pool = multiprocessing.Pool(self.NUM_WORKERS)
+
+    ''' 将图片按大小分组，每组再按 MAX_BATCH_PIXELS 切分成多个 batch；返回每个 batch 里图片的位置 '''
+
+    def __get_batch_list(self, image_list):
+        group = collections.OrderedDict()
+        for i, np_image in enumerate(image_list):
+            group.setdefault(np_image.shape, []).append(i)
+
+        batch_list = []
+        for shape, index_list in group.items():
+            batch_size = max(1, self.MAX_BATCH_PIXELS // (shape[0] * shape[1]))
+            for i in range(0, len(index_list), batch_size):
+                batch_list.append(index_list[i: i + batch_size])
+        return batch_list
+
+    ''' 等待一张图片后处理完成 '''
+
+    def __wait(self, pending):
+        img_path, record = pending.popleft().get()
+        if record is not None:
+            self.__records[os.path.splitext(os.path.split(img_path)[1])[0]] = record
+
+        self.__done_num += 1
+        progress = float(self.__done_num) / self.__task_len * 100
+        self.echo('\r Progress: %.2f | %d / %d \t %s \t ' % (progress, self.__done_num, self.__task_len,
+                                                             os.path.split(img_path)[1]), False)
+
+    ''' 运行；结束后关闭进程池 '''
+
+    def run(self, o_fcn, task_list, resize_func, pig_index=None):
+        self.__done_num = 0
+        self.__records = {}
+        self.__task_len = len(task_list)
+        chunk_list = [task_list[i: i + self.PREFETCH_IMAGES] for i in range(0, self.__task_len, self.PREFETCH_IMAGES)]
+
+        decode = lambda task: resize_func(Image.open(task[0]))
+
+        decode_pool = ThreadPool(self.NUM_DECODE_THREADS)
+        post_pool = self.__post_pool
+        pending = collections.deque()
+
+        try:
+            if not chunk_list:
+                post_pool.close()
+                return
+
+            next_result = decode_pool.map_async(decode, chunk_list[0])
+            for k, chunk in enumerate(chunk_list):
+                image_list = next_result.get()
+
+                # 处理这一组的同时，在后台解码下一组
+                if k + 1 < len(chunk_list):
+                    next_result = decode_pool.map_async(decode, chunk_list[k + 1])
+
+                for index_list in self.__get_batch_list(image_list):
+                    mask_list = o_fcn.use_model_batch(np.array([image_list[i] for i in index_list]), False)
+
+                    for i, mask in zip(index_list, mask_list):
+                        args = (mask, image_list[i], chunk[i][0], chunk[i][1], pig_index is not None)
+                        pending.append(post_pool.apply_async(_save_pig, (args,)))
+                        while len(pending) > self.MAX_PENDING:
+                            self.__wait(pending)
+
+            while pending:
+                self.__wait(pending)
+            post_pool.close()
+
+            if pig_index is not None:
+                pig_index.update(self.__records)
+                pig_index.save()
+
+        except:
+            post_pool.terminate()
+            raise
+
+        finally:
+            post_pool.join()
+            decode_pool.terminate()
+
+    ''' 输出展示 '''
+
+    @staticmethod
+    def echo(msg, crlf=True):
+        if crlf:
+            print(msg)
+        else:
+            try:
+                sys.stdout.write(msg)
+                sys.stdout.flush()
+            except:
+                print(msg)
+
+
+'''
+ 进程池的任务函数：去掉 mask 外部的点点，保存猪的图片 / 生成索引的记录；需要定义在模块层，才能被 pickle
+ 子进程是在创建 FCN 之前 fork 的，fcn 模块已经导入，不会重新加载 VGG 模型
+ 返回 (img_path, 记录)；不需要记录时记录为 None
+'''
+
+
+def _save_pig(args):
+    mask, np_image, img_path, save_path, need_record = args
+    new_mask = fcn.FCN.clean_mask(mask)
+
+    if save_path:
+        Image.fromarray((np.expand_dims(new_mask, axis=2) * np_image).astype(np.uint8)).save(save_path)
+    return img_path, PigIndex.make_record(new_mask) if need_record else None
@@ -7,11 +7,6 @@ import numpy as np
 from PIL import Image
 import tensorflow as tf
 
-if '2.7' in sys.version:
-    import Queue as queue
-else:
-    import queue
-
 # 将运行路径切换到当前文件所在路径
 cur_dir_path = os.path.abspath(os.path.split(__file__)[0])
 if cur_dir_path:
@@ -20,6 +15,7 @@ if cur_dir_path:
     sys.path.append(os.path.split(cur_dir_path)[0])
 
 import lib.base as base
+from lib.img import label_components, close_mask, fill_holes
 import load
 import model.vgg as vgg
 
@@ -51,6 +47,16 @@ class FCN(base.NN):
     ''' 类的配置 '''
 
     SHOW_PROGRESS_FREQUENCY = 2  # 每 SHOW_PROGRESS_FREQUENCY 个 step show 一次进度 progress
+    USE_LAZY_LOAD = False  # 是否按需加载数据 (内存较小时使用；见 load.Data)
+    USE_DATA_STORE = False  # 是否从 load.Store 打包好的 memmap 读取数据 (第一次运行时会先打包)
+    SPLIT_SEED = 0  # 划分 训练集 与 校验集 的随机种子；相同的种子划分结果相同
+
+    ''' mask 后处理 (mask2img) 的配置 '''
+
+    MASK_POLICY = 'center'  # 保留哪些连通区域: 'center' 质心所在的区域；'largest' 面积最大的区域；'top_k' 面积最大的 MASK_TOP_K 个区域
+    MASK_TOP_K = 2  # MASK_POLICY 为 'top_k' 时保留的区域数
+    MASK_CLOSE_SIZE = 0  # 大于 1 时，标记连通区域前先做 MASK_CLOSE_SIZE * MASK_CLOSE_SIZE 的闭运算 (连接断开的小缝)
+    MASK_FILL_HOLES = False  # 是否填补保留下来的区域里的空洞
 
     ''' 模型的配置；采用了 VGG16 模型的 FCN '''
 
@@ -267,9 +273,12 @@ class FCN(base.NN):
     ''' 加载数据 '''
 
     def load(self):
-        sort_list = load.Data.get_sort_list()
-        self.__train_set = load.Data(0.0, 0.9, 'train', sort_list)
-        self.__val_set = load.Data(0.9, 1.0, 'validation', sort_list)
+        if self.USE_DATA_STORE:
+            load.Store.run()
+
+        # 只加载一次数据，再按 img_no 分组划分 训练集 与 校验集
+        data = load.Data(0.0, 1.0, 'all', [], self.USE_LAZY_LOAD, use_store=self.USE_DATA_STORE)
+        self.__train_set, self.__val_set = data.split([0.9, 0.1], self.SPLIT_SEED, ['train', 'validation'])
         # self.__test_set = load.Data(0.8, 1.0, 'test', sort_list)
 
         self.__train_size = self.__train_set.get_size()
@@ -335,72 +344,64 @@ class FCN(base.NN):
 
         return mean_loss / times
 
-    ''' 将 输出的 mask 中不连续的点去掉，只留下质心周围连续的点 '''
+    '''
+     将 输出的 mask 中不连续的点去掉，只留下猪所在的连通区域；返回 bool 的 (h, w)
+        close_size > 1 时先做闭运算；之后只标记一次 4 连通区域 (lib/img.py 的 label_components)，再按 policy 选区域:
+        'center': 质心所在的区域；质心不在 mask 上时，取离质心最近的点 (距离相同时取行优先的第一个)
+                  与原来的广度优先搜索一致，该区域只有一个点时结果为空
+        'largest': 面积最大的区域 (面积相同时取编号小的)
+        'top_k': 面积最大的 top_k 个区域
+        fill 为 True 时填补保留下来的区域里的空洞；mask 全为 0 时结果为空
+     policy、top_k、close_size、fill 为 None 时使用类的配置 MASK_*
+    '''
 
     @staticmethod
-    def __mask2img(mask, np_image):
-        h, w = mask.shape
-
-        data = []
-        for i in range(h):
-            for j in range(w):
-                if mask[i, j] != 0:
-                    data.append([i, j])
-
-        data = np.array(data)
-        center = np.cast['int32'](np.mean(data, axis=0))
-
-        if mask[center[0], center[1]] == 0:
-            dis_mat = np.sum(np.power(data - center, 2), axis=1)
-
-            dis_list = []
-            for i, dis in enumerate(dis_mat):
-                dis_list.append([i, dis])
-            dis_list.sort(key=lambda _x: _x[1])
-
-            center = data[dis_list[0][0]]
-
-        s = set()
-        q = queue.Queue()
-        q.put(center)
-
-        while not q.empty():
-            x, y = q.get()
-
-            if x + 1 < h:
-                c = (x + 1, y)
-                if mask[c[0], c[1]] != 0:
-                    if c not in s:
-                        s.add(c)
-                        q.put(c)
-
-            if x - 1 >= 0:
-                c = (x - 1, y)
-                if mask[c[0], c[1]] != 0:
-                    if c not in s:
-                        s.add(c)
-                        q.put(c)
-
-            if y - 1 >= 0:
-                c = (x, y - 1)
-                if mask[c[0], c[1]] != 0:
-                    if c not in s:
-                        s.add(c)
-                        q.put(c)
-
-            if y + 1 < w:
-                c = (x, y + 1)
-                if mask[c[0], c[1]] != 0:
-                    if c not in s:
-                        s.add(c)
-                        q.put(c)
-
-        new_mask = np.zeros_like(mask)
-        for c in s:
-            new_mask[c[0], c[1]] = 1
-
-        new_mask = np.expand_dims(new_mask, axis=2)
-        return np.cast['uint8'](new_mask * np_image)
+    def clean_mask(mask, policy=None, top_k=None, close_size=None, fill=None):
+        policy = FCN.MASK_POLICY if policy is None else policy
+        top_k = FCN.MASK_TOP_K if top_k is None else top_k
+        close_size = FCN.MASK_CLOSE_SIZE if close_size is None else close_size
+        fill = FCN.MASK_FILL_HOLES if fill is None else fill
+
+        if policy not in ('center', 'largest', 'top_k'):
+            raise ValueError('unknown mask policy: %s' % policy)
+
+        mask = np.asarray(mask) != 0
+        if close_size > 1:
+            mask = close_mask(mask, close_size)
+
+        labels, sizes = label_components(mask)
+        keep_list = []
+
+        if len(sizes) > 1:
+            if policy == 'center':
+                ys, xs = np.nonzero(labels)
+                center = np.array([np.mean(ys), np.mean(xs)]).astype(np.int32)
+
+                if labels[center[0], center[1]] == 0:
+                    nearest = np.argmin(np.power(ys - center[0], 2) + np.power(xs - center[1], 2))
+                    center = [ys[nearest], xs[nearest]]
+
+                label = labels[center[0], center[1]]
+                if sizes[label] > 1:
+                    keep_list = [label]
+
+            elif policy == 'largest':
+                keep_list = [np.argmax(sizes[1:]) + 1]
+
+            else:
+                keep_list = list(np.argsort(-sizes[1:], kind='mergesort')[:top_k] + 1)
+
+        new_mask = np.isin(labels, keep_list) if keep_list else np.zeros(labels.shape, bool)
+        if fill and keep_list:
+            new_mask = fill_holes(new_mask)
+        return new_mask
+
+    ''' 去掉 mask 外部的点点后，生成猪的图片 (背景为黑色)；batch_segment.py 的子进程也会调用 '''
+
+    @staticmethod
+    def mask2img(mask, np_image, policy=None, top_k=None, close_size=None, fill=None):
+        new_mask = np.expand_dims(FCN.clean_mask(mask, policy, top_k, close_size, fill), axis=2)
+        return (new_mask * np_image).astype(np.uint8)
 
     ''' 主函数 '''
 
@@ -507,7 +508,9 @@ class FCN(base.NN):
             o_new_image = Image.fromarray(new_image)
             o_new_image.show()
 
-    def use_model(self, np_image):
+    ''' 第一次使用模型时 恢复并重建模型 '''
+
+    def __restore_once(self):
         if not self.__has_rebuild:
             self.restore_model_w_b()  # 恢复模型
             self.rebuild_model()  # 重建模型
@@ -515,11 +518,23 @@ class FCN(base.NN):
             self.init_variables()  # 初始化所有变量
             self.__has_rebuild = True
 
-        np_image = np.expand_dims(np_image, axis=0)
-        feed_dict = {self.__image: np_image, self.keep_prob: 1.0}
-        output_mask = self.sess.run(self.__output_mask, feed_dict)
+    def use_model(self, np_image):
+        return self.use_model_batch(np.expand_dims(np_image, axis=0))[0]
+
+    '''
+     批量使用模型；np_images 为大小相同的图片 (n, h, w, c)，一次 sess.run
+     post_process 为 True 时返回 去掉外部点点后的猪的图片 list；否则返回 mask (n, h, w) uint8，由调用方自己做后处理
+    '''
+
+    def use_model_batch(self, np_images, post_process=True):
+        self.__restore_once()
+
+        feed_dict = {self.__image: np_images, self.keep_prob: 1.0}
+        output_mask = self.sess.run(self.__output_mask, feed_dict).astype(np.uint8)
 
-        return self.__mask2img(output_mask[0], np_image[0])  # 将 mask 待人 image 并去掉外部的点点
+        if not post_process:
+            return output_mask
+        return [self.mask2img(mask, np_image) for mask, np_image in zip(output_mask, np_images)]
 
     def test_model(self):
         self.restore_model_w_b()  # 恢复模型
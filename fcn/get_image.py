@@ -3,7 +3,6 @@
 from __future__ import print_function
 import os
 import sys
-from PIL import Image
 import numpy as np
 
 # 将运行路径切换到当前文件所在路径
@@ -13,15 +12,21 @@ if cur_dir_path:
     sys.path.append(cur_dir_path)
 
 import fcn
+from batch_segment import BatchSegment
+from lib.dataset import PigIndex
 
 
 class GetImage:
     IMG_DIR = r'../data/TrainImg'
     RESIZE_SIZE = [640, 360]
 
+    SAVE_PIG_IMAGE = True  # 是否保存整幅的 <stem>_pig.jpg (背景为黑色)
+    SAVE_PIG_INDEX = True  # 是否把 bbox 与裁剪后的 mask 记录到 ../data/TrainImg_pig.json (classify/img_arg.py 优先使用)
+
     def __init__(self):
         self.__img_list = []
         self.__img_len = 0
+        self.__segment = BatchSegment()  # 需要在创建 FCN 之前构造 (创建后处理的进程池)
         self.__o_fcn = fcn.FCN(True, '2017_12_20_00_37_52')
 
     def __get_image_list(self):
@@ -35,17 +40,16 @@ class GetImage:
 
         self.__img_len = len(self.__img_list)
 
-    def __get_pig(self):
-        for i, (file_name, img_path) in enumerate(self.__img_list):
-            progress = float(i + 1) / self.__img_len * 100
-            self.echo('\r Progress: %.2f | %d / %d \t ' % (progress, i + 1, self.__img_len), False)
+    def __resize(self, image):
+        return np.array(image.resize(self.RESIZE_SIZE))
 
-            image = Image.open(img_path)
-            image = np.array(image.resize(self.RESIZE_SIZE))
+    ''' 批量分割 (见 batch_segment.py)：后台解码、按 batch 运行网络、多进程后处理 '''
 
-            np_pig = self.__o_fcn.use_model(image)
-            im_pig = Image.fromarray(np_pig)
-            im_pig.save(os.path.join(self.IMG_DIR, '%s_pig.jpg' % file_name))
+    def __get_pig(self):
+        task_list = [[img_path, os.path.join(self.IMG_DIR, '%s_pig.jpg' % file_name) if self.SAVE_PIG_IMAGE else None]
+                     for file_name, img_path in self.__img_list]
+        pig_index = PigIndex(self.IMG_DIR) if self.SAVE_PIG_INDEX else None
+        self.__segment.run(self.__o_fcn, task_list, self.__resize, pig_index)
 
     ''' 输出展示 '''
 
@@ -72,5 +76,6 @@ class GetImage:
         self.echo('\ndone')
 
 
-o_get_img = GetImage()
-o_get_img.run()
+if __name__ == '__main__':
+    o_get_img = GetImage()
+    o_get_img.run()
@@ -3,7 +3,6 @@
 from __future__ import print_function
 import os
 import sys
-from PIL import Image
 import numpy as np
 
 # 将运行路径切换到当前文件所在路径
@@ -13,6 +12,7 @@ if cur_dir_path:
     sys.path.append(cur_dir_path)
 
 import fcn
+from batch_segment import BatchSegment
 
 
 class GetImage:
@@ -23,6 +23,7 @@ class GetImage:
     def __init__(self):
         self.__img_list = []
         self.__img_len = 0
+        self.__segment = BatchSegment()  # 需要在创建 FCN 之前构造 (创建后处理的进程池)
         self.__o_fcn = fcn.FCN(True, '2017_12_20_00_37_52')
 
     def __get_image_list(self):
@@ -36,17 +37,15 @@ class GetImage:
 
         self.__img_len = len(self.__img_list)
 
-    def __get_pig(self):
-        for i, (file_name, img_path) in enumerate(self.__img_list):
-            progress = float(i + 1) / self.__img_len * 100
-            self.echo('\r Progress: %.2f | %d / %d \t ' % (progress, i + 1, self.__img_len), False)
+    def __resize(self, image):
+        return np.array(image.resize(np.cast['int32'](np.array(image.size) / self.SCALE)))
 
-            image = Image.open(img_path)
-            image = np.array(image.resize(np.cast['int32'](np.array(image.size) / self.SCALE)))
+    ''' 批量分割 (见 batch_segment.py)：后台解码、按 batch 运行网络、多进程后处理 '''
 
-            np_pig = self.__o_fcn.use_model(image)
-            im_pig = Image.fromarray(np_pig)
-            im_pig.save(os.path.join(self.IMG_DIR, '%s_pig.jpg' % file_name))
+    def __get_pig(self):
+        task_list = [[img_path, os.path.join(self.IMG_DIR, '%s_pig.jpg' % file_name)]
+                     for file_name, img_path in self.__img_list]
+        self.__segment.run(self.__o_fcn, task_list, self.__resize)
 
     ''' 输出展示 '''
 
@@ -73,5 +72,6 @@ class GetImage:
         self.echo('\ndone')
 
 
-o_get_img = GetImage()
-o_get_img.run()
+if __name__ == '__main__':
+    o_get_img = GetImage()
+    o_get_img.run()
@@ -0,0 +1,207 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import os
+import sys
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+
+if '2.7' in sys.version:
+    import Queue as queue
+else:
+    import queue
+
+# 将运行路径切换到当前文件所在路径
+cur_dir_path = os.path.abspath(os.path.split(__file__)[0])
+if cur_dir_path:
+    os.chdir(cur_dir_path)
+    sys.path.append(cur_dir_path)
+    sys.path.append(os.path.split(cur_dir_path)[0])
+
+import fcn
+from lib.video import FrameSampler
+from lib.img import get_bbox
+
+'''
+ 视频 -> 切割猪 的流式处理
+ 相当于 video_process/video2image.py + get_image.py + classify/img_arg.py 生成猪的原图的部分，但中间结果不落地:
+    解码线程: 视频抽帧，resize 成 RESIZE_SIZE (PIL)      -> decode_queue
+    主线程:   FCN.use_model 切割出猪                      -> write_queue
+    写线程:   用最小的框框住猪，保存到 IMG_MORE_DIR
+ 只保存最终的两张图 (命名与 classify/img_arg.py 一致):
+    <video_no>_<file_no>_0.jpg: 框住的猪 (背景为黑色)
+    <video_no>_<file_no>_1.jpg: 框住的猪 (带背景)
+ 队列都有长度上限，解码或写文件比 FCN 快时会阻塞等待，内存占用不会随视频长度增长
+ 解码线程、写线程出错时记录异常并通知其他阶段停止 (等待队列时不会一直阻塞)，run 结束时在主线程重新抛出
+'''
+
+
+class GetVideoPig:
+    VIDEO_DIR = r'../data/TrainVideo'
+    IMG_MORE_DIR = r'../data/TrainImgMore'
+    RESIZE_SIZE = [640, 360]
+
+    SAMPLE_MODE = FrameSampler.MODE_FRAME  # 与 video_process/video2image.py 一致
+    IMG_PER_FRAME = 29
+    TIME_INTERVAL = 0.5
+
+    QUEUE_SIZE = 16  # 各阶段之间队列的长度上限
+    WAIT_TIMEOUT = 0.5  # 等待队列时，每隔多少秒检查一次其他阶段是否已经出错
+    MIN_PIG_SIZE = 50  # 框住猪的框小于该值时，不保存带背景的图
+
+    def __init__(self):
+        self.__video_list = []
+        self.__decode_queue = queue.Queue(self.QUEUE_SIZE)
+        self.__write_queue = queue.Queue(self.QUEUE_SIZE)
+        self.__stop_event = threading.Event()  # 某个阶段出错时设置，其他阶段不再等待队列
+        self.__error = None  # 解码线程、写线程的异常
+        self.__frame_num = 0
+        self.__o_fcn = fcn.FCN(True, '2017_12_20_00_37_52')
+
+    def __get_video_list(self):
+        for file_name in os.listdir(self.VIDEO_DIR):
+            if os.path.splitext(file_name)[1].lower() != '.mp4':
+                continue
+            self.__video_list.append(os.path.join(self.VIDEO_DIR, file_name))
+
+        if not os.path.isdir(self.IMG_MORE_DIR):
+            os.mkdir(self.IMG_MORE_DIR)
+
+    ''' 放入队列；其他阶段已经出错 (stop_event 被设置) 时不再等待，返回 False '''
+
+    def __put(self, q, item):
+        while not self.__stop_event.is_set():
+            try:
+                q.put(item, timeout=self.WAIT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    ''' 从队列取出；其他阶段已经出错时不再等待，返回 None '''
+
+    def __get(self, q):
+        while not self.__stop_event.is_set():
+            try:
+                return q.get(timeout=self.WAIT_TIMEOUT)
+            except queue.Empty:
+                continue
+        return None
+
+    ''' 后台线程出错：记录异常，通知其他阶段停止 '''
+
+    def __fail(self, e):
+        if self.__error is None:
+            self.__error = e
+        self.__stop_event.set()
+
+    ''' 解码线程：抽帧并 resize；结束时放入 None '''
+
+    def __decode(self):
+        try:
+            for video_path in self.__video_list:
+                video_no = os.path.splitext(os.path.split(video_path)[1])[0]
+                sampler = FrameSampler(video_path, self.SAMPLE_MODE, self.IMG_PER_FRAME, self.TIME_INTERVAL)
+
+                try:
+                    for file_no, (_, frame) in enumerate(sampler):
+                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # 与 PIL 读取的图片一样，转为 RGB
+                        frame = np.array(Image.fromarray(frame).resize(self.RESIZE_SIZE))  # 与 get_image.py 的 resize 一致
+                        if not self.__put(self.__decode_queue, ['%s_%d' % (video_no, file_no + 1), frame]):
+                            return
+                finally:
+                    sampler.close()
+
+            self.__put(self.__decode_queue, None)
+
+        except Exception as e:
+            self.__fail(e)
+
+    ''' 写线程：框住猪并保存；收到 None 时结束 '''
+
+    def __write(self):
+        try:
+            while True:
+                item = self.__get(self.__write_queue)
+                if item is None:
+                    break
+
+                im_name, np_frame, np_pig = item
+                pos = get_bbox(np_pig)
+
+                np_pig = np_pig[pos[0]: pos[1] + 1, pos[2]: pos[3] + 1]
+                Image.fromarray(np_pig).save(os.path.join(self.IMG_MORE_DIR, '%s_0.jpg' % im_name))
+
+                if pos[1] - pos[0] < self.MIN_PIG_SIZE or pos[3] - pos[2] < self.MIN_PIG_SIZE:
+                    continue
+
+                np_frame = np_frame[pos[0]: pos[1] + 1, pos[2]: pos[3] + 1]
+                Image.fromarray(np_frame).save(os.path.join(self.IMG_MORE_DIR, '%s_1.jpg' % im_name))
+
+        except Exception as e:
+            self.__fail(e)
+
+    ''' 主线程：FCN 切割出猪；后台线程出错时提前结束 '''
+
+    def __segment(self):
+        while True:
+            item = self.__get(self.__decode_queue)
+            if item is None:
+                break
+
+            im_name, np_frame = item
+            np_pig = self.__o_fcn.use_model(np_frame)
+            if not self.__put(self.__write_queue, [im_name, np_frame, np_pig]):
+                break
+
+            self.__frame_num += 1
+            self.echo('\r Progress: %d frames | %s \t ' % (self.__frame_num, im_name), False)
+
+    ''' 输出展示 '''
+
+    @staticmethod
+    def echo(msg, crlf=True):
+        if crlf:
+            print(msg)
+        else:
+            try:
+                sys.stdout.write(msg)
+                sys.stdout.flush()
+            except:
+                print(msg)
+
+    def run(self):
+        self.echo('\nGetting video list ...')
+        self.__get_video_list()
+        self.echo('Finish getting video list')
+
+        self.echo('\nGetting pig ...')
+        decode_thread = threading.Thread(target=self.__decode, name='decode_video')
+        write_thread = threading.Thread(target=self.__write, name='write_pig')
+        decode_thread.daemon = True
+        decode_thread.start()
+        write_thread.start()
+
+        try:
+            self.__segment()
+        except:
+            self.__stop_event.set()  # 主线程出错，后台线程不再等待
+            raise
+        finally:
+            self.__put(self.__write_queue, None)
+            write_thread.join()
+            decode_thread.join()
+
+        # 后台线程的异常在主线程重新抛出，不把只处理了一部分的结果当作成功
+        if self.__error is not None:
+            raise self.__error
+        self.echo('\nFinish getting pig')
+
+        self.echo('\ndone')
+
+
+if __name__ == '__main__':
+    o_get_video_pig = GetVideoPig()
+    o_get_video_pig.run()
@@ -4,12 +4,24 @@ from __future__ import print_function
 import os
 import sys
 import copy
+import json
 import random
 import zipfile
+import threading
+import collections
 import numpy as np
 from PIL import Image
 from six.moves.urllib.request import urlretrieve
 
+if '2.7' in sys.version:
+    import Queue as queue
+else:
+    import queue
+
+# lib 在上一级目录
+sys.path.append(os.path.split(os.path.abspath(os.path.split(__file__)[0]))[0])
+from lib.dataset import FileIndex
+
 '''
     下载数据
 '''
@@ -105,11 +117,133 @@ class Download:
         print('done')
 
 
+'''
+ Store: 将 data 里的图片与 mask 一次性解码、resize 后，打包成连续的 .npy 文件，之后可以用 memmap 直接读取
+    images.npy: (N, 360, 640, 3) uint8
+    masks.npy:  (N, 360, 640) uint8；每个像素的类别: 0 为都不是，1 为猪，2 为背景 (与 Data 的 2 通道 mask 一一对应)
+    index.json: 每一行对应的图片文件名、图片编号 (img_no)，以及 data 里图片的数量 (数量变化时需要重新打包)
+ 用法: 运行一次 Store.run()，之后 Data(..., use_store=True) 即可
+'''
+
+
+class Store:
+    STORE_DIR = r'data_store'
+    IMAGES_FILE = 'images.npy'
+    MASKS_FILE = 'masks.npy'
+    INDEX_FILE = 'index.json'
+
+    LABEL_FG = 1
+    LABEL_BG = 2
+
+    def __init__(self):
+        pass
+
+    ''' data 里的图片 (不含 mask) '''
+
+    @staticmethod
+    def __get_file_list():
+        file_list = []
+        for stem, file_name, no_list in FileIndex.get(Data.DATA_ROOT).get_list():
+            if 'mask' in file_name:
+                continue
+            file_list.append(file_name)
+        return sorted(file_list)
+
+    ''' 判断打包的数据是否存在且与 data 一致 '''
+
+    @staticmethod
+    def exist():
+        index_path = os.path.join(Store.STORE_DIR, Store.INDEX_FILE)
+        if not os.path.isfile(index_path):
+            return False
+
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        return index['file_num'] == len(Store.__get_file_list())
+
+    ''' 将 mask 转为每个像素一个类别 '''
+
+    @staticmethod
+    def mask2label(mask):
+        return (mask[:, :, 1] * Store.LABEL_FG + mask[:, :, 0] * Store.LABEL_BG).astype(np.uint8)
+
+    ''' 将类别转回 Data 使用的 2 通道 mask；label 可以是多张图 '''
+
+    @staticmethod
+    def label2mask(label):
+        return np.stack([label == Store.LABEL_BG, label == Store.LABEL_FG], axis=-1).astype(np.uint8)
+
+    ''' 打包数据；先写临时文件，全部完成后再替换，中断时不会留下不完整的数据 '''
+
+    @staticmethod
+    def run(force=False):
+        if not force and Store.exist():
+            print('store exist in %s' % Store.STORE_DIR)
+            return
+
+        if not os.path.isdir(Store.STORE_DIR):
+            os.mkdir(Store.STORE_DIR)
+
+        file_list = Store.__get_file_list()
+        file_len = len(file_list)
+        w, h = Data.RESIZE_SIZE
+
+        images_tmp_path = os.path.join(Store.STORE_DIR, Store.IMAGES_FILE + '.tmp')
+        masks_tmp_path = os.path.join(Store.STORE_DIR, Store.MASKS_FILE + '.tmp')
+        images = np.lib.format.open_memmap(images_tmp_path, mode='w+', dtype=np.uint8, shape=(file_len, h, w, 3))
+        masks = np.lib.format.open_memmap(masks_tmp_path, mode='w+', dtype=np.uint8, shape=(file_len, h, w))
+
+        index = {'file_num': file_len, 'file_list': [], 'img_no_list': []}
+        for i, file_name in enumerate(file_list):
+            sys.stdout.write('\r >> packing %.2f%% \t' % (float(i + 1) / file_len * 100))
+            sys.stdout.flush()
+
+            img_no = file_name.split('_')[0]
+            np_image, mask = Data.decode(os.path.join(Data.DATA_ROOT, file_name), img_no + '_mask.jpg')
+
+            images[i] = np_image
+            masks[i] = Store.mask2label(mask)
+            index['file_list'].append(file_name)
+            index['img_no_list'].append(int(img_no))
+
+        images.flush()
+        masks.flush()
+        del images, masks
+
+        for file_name in [Store.IMAGES_FILE, Store.MASKS_FILE]:
+            path = os.path.join(Store.STORE_DIR, file_name)
+            if os.path.isfile(path):
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+
+        with open(os.path.join(Store.STORE_DIR, Store.INDEX_FILE), 'w') as f:
+            json.dump(index, f)
+
+        print('\nFinish packing %d images to %s' % (file_len, Store.STORE_DIR))
+
+    ''' 读取打包的数据；images、masks 为 memmap，不会读入内存 '''
+
+    @staticmethod
+    def load():
+        with open(os.path.join(Store.STORE_DIR, Store.INDEX_FILE), 'r') as f:
+            index = json.load(f)
+
+        images = np.load(os.path.join(Store.STORE_DIR, Store.IMAGES_FILE), mmap_mode='r')
+        masks = np.load(os.path.join(Store.STORE_DIR, Store.MASKS_FILE), mmap_mode='r')
+        return images, masks, index
+
+
 '''
  Data: 取数据到基类
  对外提供接口:
     get_size()
     next_batch()
+ lazy 为 False 时，初始化时一次性解码全部图片到内存；
+ lazy 为 True 时，只保存文件列表，next_batch 时按需解码:
+    解码后的样本放在 LRU 缓存里，缓存总大小不超过 cache_bytes
+    后台线程会提前解码下一个 batch，放进缓存
+    内存占用与数据集大小无关
+ use_store 为 True 时，从 Store 打包好的 memmap 里读取 (需要先运行 Store.run())，启动时不需要解码图片；此时忽略 lazy
 '''
 
 
@@ -118,10 +252,14 @@ class Data:
     IMAGE_SCALE = 2
     RESIZE_SIZE = [640, 360]
 
-    def __init__(self, start_ratio=0.0, end_ratio=1.0, name='', sort_list=[]):
+    CACHE_BYTES = 1024 * 1024 * 1024  # lazy 模式下 LRU 缓存的大小上限 (默认 1 GB)
+
+    def __init__(self, start_ratio=0.0, end_ratio=1.0, name='', sort_list=[], lazy=False, cache_bytes=None,
+                 use_store=False):
         # 初始化变量
         self.__name = name
         self.__data = []
+        self.__group = []  # __data 里每个样本的 img_no
         self.__data_dict = {}
         self.__data_list = []
         self.__y = {}
@@ -129,8 +267,20 @@ class Data:
 
         self.__sort_list = sort_list
 
+        # lazy 模式的变量；use_store 时直接从 memmap 读取，不需要 lazy (__data 里存放的是行号而不是文件)
+        self.__lazy = lazy and not use_store
+        self.__cache_bytes = cache_bytes if cache_bytes else self.CACHE_BYTES
+        self.__init_cache()
+
+        # use_store 模式的变量
+        self.__images = None
+        self.__masks = None
+
         # 加载全部数据
-        self.__load()
+        if use_store:
+            self.__load_store()
+        else:
+            self.__load()
         self.__data_len = len(self.__data_list)
 
         # 检查输入参数
@@ -147,33 +297,66 @@ class Data:
         for (img_no, data_list) in self.__data_list:
             for data in data_list:
                 self.__data.append(data)
+                self.__group.append(img_no)
 
         self.__data_len = len(self.__data)
-        random.shuffle(self.__data)
+
+        # 打乱顺序 (__data 与 __group 同时打乱)
+        shuffle_index = list(range(self.__data_len))
+        random.shuffle(shuffle_index)
+        self.__data = [self.__data[i] for i in shuffle_index]
+        self.__group = [self.__group[i] for i in shuffle_index]
 
         self.__cur_index = 0
 
+    ''' lazy 模式的缓存以及后台线程；后台线程在第一次 next_batch 时才启动 '''
+
+    def __init_cache(self):
+        self.__cache = collections.OrderedDict()  # img_path -> [np_image, mask]；越靠后越是最近用过的
+        self.__cache_size = 0
+        self.__cache_lock = threading.Lock()
+        self.__prefetch_queue = queue.Queue(1)
+        self.__prefetch_thread = None
+
+    ''' 按 sort_list 的顺序排列各组图片；sort_list 为空时按 img_no 排序 '''
+
+    def __sort_data_list(self):
+        if not self.__sort_list:
+            self.__data_list.sort(key=lambda x: x[0])
+            return
+
+        # 预先算好每个 img_no 的排名，避免每次比较都 list.index (O(n^2))
+        rank = dict([(img_no, i) for i, img_no in enumerate(self.__sort_list)])
+        self.__data_list.sort(key=lambda x: rank[x[0]])
+
     ''' 加载数据 '''
 
     def __load(self):
         self.echo('Loading %s data ...' % self.__name)
-        file_list = os.listdir(self.DATA_ROOT)
+        file_list = FileIndex.get(self.DATA_ROOT).get_list()
         file_len = len(file_list)
 
-        for i, file_name in enumerate(file_list):
+        for i, (_, file_name, _) in enumerate(file_list):
             progress = float(i) / file_len * 100
             self.echo('\rprogress: %.2f%% \t' % progress, False)
 
-            if os.path.splitext(file_name)[1].lower() != '.jpg':
-                continue
-
-            if 'mask' in file_name and file_name not in self.__y:
+            if 'mask' in file_name and file_name not in self.__y and not self.__lazy:
                 self.__y[file_name] = self.__get_mask(file_name)
 
             if 'mask' not in file_name:
                 img_no = file_name.split('_')[0]
                 y_file_name = img_no + '_mask.jpg'
 
+                self.__total_size += 1
+
+                if img_no not in self.__data_dict:
+                    self.__data_dict[img_no] = []
+
+                # lazy 模式只记录文件，用到时再解码
+                if self.__lazy:
+                    self.__data_dict[img_no].append([os.path.join(self.DATA_ROOT, file_name), y_file_name])
+                    continue
+
                 if y_file_name not in self.__y:
                     self.__y[y_file_name] = self.__get_mask(y_file_name)
 
@@ -182,19 +365,34 @@ class Data:
                 np_image = np.array(image.resize(np.array(Data.RESIZE_SIZE)))
                 # self.__data.append([image, self.__y[y_file_name]])
 
-                self.__total_size += 1
-
-                if img_no not in self.__data_dict:
-                    self.__data_dict[img_no] = []
-                self.__data_dict[img_no].append([np_image, self.__get_same_size_mask(image, y_file_name)])
+                self.__data_dict[img_no].append([np_image, self.__get_same_size_mask(self.__y[y_file_name])])
 
         for img_no, data_list in self.__data_dict.items():
             self.__data_list.append([int(img_no), data_list])
 
-        self.__data_list.sort(key=lambda x: self.__sort_list.index(x[0]) if self.__sort_list else x[0])
+        self.__sort_data_list()
 
         self.echo('\nFinish Loading\n')
 
+    ''' 从 Store 加载；__data 里存放的是 memmap 的行号 '''
+
+    def __load_store(self):
+        self.echo('Loading %s data from %s ...' % (self.__name, Store.STORE_DIR))
+        self.__images, self.__masks, index = Store.load()
+
+        for i, img_no in enumerate(index['img_no_list']):
+            if img_no not in self.__data_dict:
+                self.__data_dict[img_no] = []
+            self.__data_dict[img_no].append(i)
+
+        self.__total_size = len(index['img_no_list'])
+        for img_no, data_list in self.__data_dict.items():
+            self.__data_list.append([int(img_no), data_list])
+
+        self.__sort_data_list()
+
+        self.echo('Finish Loading\n')
+
     ''' 将 mask 图转为 0 1 像素 '''
 
     @staticmethod
@@ -204,8 +402,8 @@ class Data:
 
     ''' 获取跟 image 相同 size 的 mask '''
 
-    def __get_same_size_mask(self, image, y_file_name):
-        mask = self.__y[y_file_name]
+    @staticmethod
+    def __get_same_size_mask(mask):
         # mask = np.array( mask.resize( np.array(image.size) / Data.IMAGE_SCALE ) )
         mask = np.array(mask.resize(np.array(Data.RESIZE_SIZE)))
 
@@ -217,45 +415,135 @@ class Data:
         mask[mask > 0] = 1
         return np.array([background, mask]).transpose([1, 2, 0])
 
+    ''' 解码一个样本 (lazy 模式以及 Store 打包时使用) '''
+
+    @staticmethod
+    def decode(img_path, y_file_name):
+        image = Image.open(img_path)
+        np_image = np.array(image.resize(np.array(Data.RESIZE_SIZE)))
+        return [np_image, Data.__get_same_size_mask(Data.__get_mask(y_file_name))]
+
+    ''' 获取一个样本；lazy 模式下先查 LRU 缓存，没有再解码并放入缓存 '''
+
+    def __get_sample(self, data):
+        if not self.__lazy:
+            return data
+
+        img_path, y_file_name = data
+        with self.__cache_lock:
+            if img_path in self.__cache:
+                sample = self.__cache.pop(img_path)
+                self.__cache[img_path] = sample
+                return sample
+
+        sample = self.decode(img_path, y_file_name)
+        sample_size = sample[0].nbytes + sample[1].nbytes
+
+        with self.__cache_lock:
+            if img_path not in self.__cache:
+                self.__cache[img_path] = sample
+                self.__cache_size += sample_size
+
+            # 超出大小上限时，淘汰最久没用过的样本
+            while self.__cache_size > self.__cache_bytes and len(self.__cache) > 1:
+                _, (old_image, old_mask) = self.__cache.popitem(last=False)
+                self.__cache_size -= old_image.nbytes + old_mask.nbytes
+        return sample
+
+    ''' 后台线程：解码 prefetch_queue 里的 batch，放入缓存 '''
+
+    def __prefetch(self):
+        while True:
+            index_list = self.__prefetch_queue.get()
+            for i in index_list:
+                self.__get_sample(self.__data[i])
+
+    ''' 从 cur_index 开始的 batch_size 个样本的位置；loop 为 True 时到末尾后从头开始 '''
+
+    def __get_index_list(self, cur_index, batch_size, loop):
+        if not loop:
+            end_index = min(cur_index + batch_size, self.__data_len)
+            return list(range(cur_index, end_index)), end_index
+
+        index_list = [(cur_index + i) % self.__data_len for i in range(batch_size)]
+        return index_list, (cur_index + batch_size) % self.__data_len
+
     ''' 获取下个 batch '''
 
     def next_batch(self, batch_size, loop=True):
         if not loop and self.__cur_index >= self.__data_len:
             return None, None
 
-        start_index = self.__cur_index
-        end_index = self.__cur_index + batch_size
-        left_num = 0
+        index_list, self.__cur_index = self.__get_index_list(self.__cur_index, batch_size, loop)
 
-        if end_index >= self.__data_len:
-            left_num = end_index - self.__data_len
-            end_index = self.__data_len
+        if self.__lazy and not self.__prefetch_thread:
+            self.__prefetch_thread = threading.Thread(target=self.__prefetch, name='prefetch_%s_data' % self.__name)
+            self.__prefetch_thread.daemon = True
+            self.__prefetch_thread.start()
 
-        X, y = zip(*self.__data[start_index: end_index])
+        # 让后台线程提前解码下一个 batch (上一个还没解码完时跳过)
+        if self.__lazy and (loop or self.__cur_index < self.__data_len):
+            try:
+                self.__prefetch_queue.put_nowait(self.__get_index_list(self.__cur_index, batch_size, loop)[0])
+            except queue.Full:
+                pass
 
-        if not loop:
-            self.__cur_index = end_index
-            return np.array(X), np.array(y)
-
-        if not left_num:
-            self.__cur_index = end_index if end_index < self.__data_len else 0
-            return np.array(X), np.array(y)
-
-        while left_num:
-            end_index = left_num
-            if end_index > self.__data_len:
-                left_num = end_index - self.__data_len
-                end_index = self.__data_len
-            else:
-                left_num = 0
-
-            left_x, left_y = zip(*self.__data[: end_index])
-            X += left_x
-            y += left_y
-
-        self.__cur_index = end_index if end_index < self.__data_len else 0
+        # Store 模式直接从 memmap 按行号取出整个 batch
+        if self.__images is not None:
+            rows = [self.__data[i] for i in index_list]
+            return np.asarray(self.__images[rows]), Store.label2mask(np.asarray(self.__masks[rows]))
+
+        X, y = zip(*[self.__get_sample(self.__data[i]) for i in index_list])
         return np.array(X), np.array(y)
 
+    '''
+     按 img_no 分组划分数据集，同一 img_no 的图片只会出现在同一个集合里
+        group_list: 每个样本的 img_no
+        ratio_list: 各个集合占的比例 (按组数计算)，如 [0.9, 0.1]
+        seed:       随机种子；seed 相同时划分结果相同
+     返回每个集合的样本位置 (np.array) 的 list
+    '''
+
+    @staticmethod
+    def group_split(group_list, ratio_list, seed=0):
+        group_list = np.asarray(group_list)
+        groups = np.unique(group_list)
+        np.random.RandomState(seed).shuffle(groups)
+
+        # 第 k 个集合包含打乱后的第 bounds[k - 1] 到 bounds[k] 组
+        ratio_list = np.cumsum(ratio_list, dtype=np.float64) / np.sum(ratio_list)
+        bounds = (ratio_list * len(groups)).astype(np.int64)
+        group_split_no = np.searchsorted(bounds, np.arange(len(groups)), side='right')
+
+        # 每个样本所属的集合
+        sorter = np.argsort(groups)
+        split_no = group_split_no[sorter][np.searchsorted(groups, group_list, sorter=sorter)]
+
+        return [np.nonzero(split_no == k)[0] for k in range(len(ratio_list))]
+
+    '''
+     取 index_list 对应的样本组成新的数据集；与原数据集共用已加载的数据，不需要重新读取
+     lazy 模式下新数据集的缓存上限按样本数占原数据集的比例分配，split 出的各个数据集加起来不超过原来的 cache_bytes
+    '''
+
+    def subset(self, index_list, name=''):
+        new_data = copy.copy(self)
+        new_data.__name = name
+        new_data.__data = [self.__data[i] for i in index_list]
+        new_data.__group = [self.__group[i] for i in index_list]
+        new_data.__data_len = len(new_data.__data)
+        new_data.__cur_index = 0
+        new_data.__cache_bytes = int(self.__cache_bytes * float(new_data.__data_len) / max(self.__data_len, 1))
+        new_data.__init_cache()
+        return new_data
+
+    ''' 按 img_no 分组划分成多个数据集；只需要加载一次数据 '''
+
+    def split(self, ratio_list, seed=0, name_list=None):
+        name_list = name_list if name_list else ['%s_%d' % (self.__name, i) for i in range(len(ratio_list))]
+        index_lists = self.group_split(self.__group, ratio_list, seed)
+        return [self.subset(index_list, name_list[i]) for i, index_list in enumerate(index_lists)]
+
     ''' 获取数据集大小 '''
 
     def get_size(self):
@@ -282,12 +570,8 @@ class Data:
     @staticmethod
     def get_sort_list():
         img_no_set = set()
-        for i, file_name in enumerate(os.listdir(Data.DATA_ROOT)):
-            if os.path.splitext(file_name)[1].lower() != '.jpg':
-                continue
-
-            img_no = int(file_name.split('_')[0])
-            img_no_set.add(img_no)
+        for stem, file_name, no_list in FileIndex.get(Data.DATA_ROOT).get_list():
+            img_no_set.add(int(no_list[0]))
 
         img_no_list = list(img_no_set)
         random.shuffle(img_no_list)
@@ -36,6 +36,7 @@ from tensorflow.python.training import moving_averages
       学习率的初始化
       执行 tf 的所有变量的初始化
     保存模型
+    导出冻结的推理模型 (常量权重，折叠 batch normalize 与输入的 normalize)
     TensorBoard summary
     常用模型
       全连接模型
@@ -85,6 +86,7 @@ class NN:
     CONV_WEIGHT_STDDEV = 0.01  # truncated normal distribution 的 std
 
     EPSILON = 0.0001  # 输入 做 batch normalize 时需要用到
+    INPUT_MOMENT = 0.975  # 训练时 输入的 running mean / std 的移动平均系数
 
     ''' 模型的配置 '''
 
@@ -163,6 +165,10 @@ class NN:
         # 若 USE_MULTI 为 True 时，该值才有意义
         self.net_id = 0
 
+        # normalize_input 建立的 op，训练时与 train_op 一起 run
+        self.t_input_update = None
+        self.__t_input_moments = []
+
         # dropout 的 keep_prob，为 tensor 对象
         self.keep_prob = None
         self.keep_prob_dict = {}
@@ -495,6 +501,205 @@ class NN:
 
         self.echo('Finish restoring ')
 
+    # ************************* 导出冻结的推理模型 ***************************
+
+    '''
+     将保存的模型 (save_model_w_b 的 .pkl) 导出为冻结的推理图 (GraphDef, .pb)
+        权重全部为 tf.constant，不需要 restore 为 tf.Variable、也不需要 global_variables_initializer
+        batch normalize (moving_mean / moving_variance / beta / gamma) 折叠进它前面的 conv 的 W、b
+        输入的 normalize (x - mean_x) / (std_x + EPSILON) 折叠进第一层 conv / fc:
+            除以 std 总是折叠进 W；减去 mean 在第一层为 fc 或 padding 为 VALID 的 conv 时折叠进 b，
+            padding 为 SAME 时在图的开头保留一个减法 (补的 0 在 normalize 后的输入里对应的是 mean，直接折叠边界会不一致)
+        去掉 dropout 与 is_train 的分支
+     input_shape 为一张输入图片的 shape (如 [224, 224, 3])；输入为 'input:0' (float32，未 normalize)，输出为 'output:0'
+     USE_MULTI 时导出第 net_id 个网络；返回 .pb 的路径
+    '''
+
+    def export_frozen_graph(self, input_shape, output_path=None):
+        if self.USE_MULTI:
+            model_path = '%s_%d.pkl' % (self.get_model_path(), self.net_id)
+        else:
+            model_path = self.get_model_path()
+        output_path = output_path or self.get_frozen_graph_path()
+
+        self.echo('\nExporting frozen graph to %s ...' % os.path.split(output_path)[1])
+
+        with open(model_path, 'rb') as f:
+            save_dict = pickle.load(f)
+
+        # 输入的 normalize: x * scale + shift
+        input_norm = None
+        if self.USE_BN_INPUT:
+            if self.USE_MULTI:
+                mean_x = save_dict['multi_mean_x'][self.net_id]
+                std_x = save_dict['multi_std_x'][self.net_id]
+            else:
+                mean_x = save_dict['mean_x']
+                std_x = save_dict['std_x']
+            scale = 1.0 / (np.asarray(std_x, np.float64) + self.EPSILON)
+            input_norm = [scale, -np.asarray(mean_x, np.float64) * scale]
+
+        graph = tf.Graph()
+        with graph.as_default():
+            X = tf.placeholder(tf.float32, [None] + list(input_shape), name='input')
+            a = X
+            net = {}
+            model_len = len(self.MODEL)
+
+            for i, config in enumerate(self.MODEL):
+                _type = config['type'].lower()
+                name = '%s_%d' % (_type, i + 1) if 'name' not in config else config['name']
+
+                # 第一层不是 conv / fc 时，直接在图里做输入的 normalize
+                if input_norm is not None and _type not in ('conv', 'fc', 'dropout'):
+                    a = a * input_norm[0].astype(np.float32) + input_norm[1].astype(np.float32)
+                    input_norm = None
+
+                if _type in ('conv', 'fc', 'tr_conv'):
+                    W, b = self.__get_frozen_w_b(save_dict, config, name)
+
+                    if _type == 'conv':
+                        padding = 'SAME' if 'padding' not in config or config['padding'] == 'SAME' else 'VALID'
+                        if input_norm is not None:
+                            W, b, a = self.__fold_input_norm_conv(W, b, a, input_norm, padding == 'SAME')
+                            input_norm = None
+
+                        if 'bn' in config and config['bn']:
+                            W, b = self.__fold_bn(save_dict, W, b, name)
+
+                    elif _type == 'fc' and input_norm is not None:
+                        W, b = self.__fold_input_norm_fc(W, b, input_norm, input_shape)
+                        input_norm = None
+
+                    W = W.astype(np.float32)
+                    b = None if b is None else b.astype(np.float32)
+
+                with tf.name_scope(name):
+                    if _type == 'conv':
+                        stride = config['stride'] if 'stride' in config else 1
+                        a = self.conv2d(a, tf.constant(W, name='weight'), stride, padding)
+                        if b is not None:
+                            a = tf.nn.bias_add(a, tf.constant(b, name='bias'))
+
+                        if 'activate' not in config or config['activate']:
+                            a = self.activate(a)
+
+                    elif _type == 'fc':
+                        x = tf.reshape(a, [-1, W.shape[0]])
+                        a = tf.nn.bias_add(tf.matmul(x, tf.constant(W, name='weight')), tf.constant(b, name='bias'))
+
+                        if config.get('activate', i < model_len - 1):
+                            a = self.activate(a)
+
+                    elif _type == 'tr_conv':
+                        if 'output_shape' in config:
+                            output_shape = config['output_shape']
+                        elif 'output_shape_index' in config:
+                            output_shape = tf.shape(net[config['output_shape_index']])
+                        elif 'output_shape_x' in config:
+                            keep = [0 if val_j else 1 for val_j in config['output_shape_x']]
+                            output_shape = tf.shape(X) * tf.constant(keep) + tf.constant(config['output_shape_x'])
+                        else:
+                            output_shape = None
+
+                        stride = config['stride'] if 'stride' in config else 2
+                        a = self.conv2d_transpose_stride(a, tf.constant(W, name='weight'), tf.constant(b, name='bias'),
+                                                         output_shape, stride)
+
+                    elif _type == 'pool':
+                        k_size = [config['k_size'], config['k_size']]
+                        stride = config['stride'] if 'stride' in config else None
+                        if 'pool_type' not in config or config['pool_type'] == 'max':
+                            a = self.max_pool(a, k_size, stride)
+                        else:
+                            a = self.avg_pool(a, k_size, stride)
+
+                    elif _type == 'add':
+                        a = tf.add(a, net[config['layer_index']])
+
+                    # dropout 在推理时为恒等变换，直接去掉
+
+                net[name] = a
+
+            tf.identity(a, name='output')
+
+        with open(output_path, 'wb') as f:
+            f.write(graph.as_graph_def().SerializeToString())
+
+        self.echo('Finish exporting frozen graph (%d ops)' % len(graph.get_operations()))
+        return output_path
+
+    ''' export_frozen_graph 默认导出的路径 (与 .pkl 同名的 .pb)；USE_MULTI 时为第 net_id 个网络的 '''
+
+    def get_frozen_graph_path(self):
+        if self.USE_MULTI:
+            return '%s_%d.pb' % (self.get_model_path(), self.net_id)
+        return '%s.pb' % os.path.splitext(self.get_model_path())[0]
+
+    '''
+     加载 export_frozen_graph 导出的模型；只需要一次 import_graph_def
+     返回 (graph, 输入的 tensor, 输出的 tensor)；使用时 tf.Session(graph=graph)
+    '''
+
+    @staticmethod
+    def load_frozen_graph(pb_path):
+        graph_def = tf.GraphDef()
+        with open(pb_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        return graph, graph.get_tensor_by_name('input:0'), graph.get_tensor_by_name('output:0')
+
+    ''' 冻结时获取某层的 W、b (numpy, float64)；与 parse_model_rebuild 一致，不训练的层使用 MODEL 里的 W、b '''
+
+    @staticmethod
+    def __get_frozen_w_b(save_dict, config, name):
+        if 'trainable' in config and not config['trainable']:
+            W = config['W']
+            b = config['b'] if 'use_bias' not in config or config['use_bias'] else None
+        else:
+            W = save_dict['w_dict'][name][1]
+            b = save_dict['b_dict'][name][1] if name in save_dict['b_dict'] else None
+        return np.asarray(W, np.float64), None if b is None else np.asarray(b, np.float64)
+
+    ''' 将 batch normalize 折叠进 conv: y = gamma * (conv + b - moving_mean) / sqrt(moving_variance + BN_EPSILON) + beta '''
+
+    def __fold_bn(self, save_dict, W, b, name):
+        gamma = np.asarray(save_dict['gamma'][name], np.float64)
+        beta = np.asarray(save_dict['beta'][name], np.float64)
+        moving_mean = np.asarray(save_dict['moving_mean'][name], np.float64)
+        moving_variance = np.asarray(save_dict['moving_std'][name], np.float64)
+
+        scale = gamma / np.sqrt(moving_variance + self.BN_EPSILON)
+        b = 0.0 if b is None else b
+        return W * scale, (b - moving_mean) * scale + beta
+
+    ''' 将输入的 normalize 折叠进第一层 conv；返回 (W, b, 输入) '''
+
+    @staticmethod
+    def __fold_input_norm_conv(W, b, a, input_norm, same_padding):
+        scale, shift = [np.broadcast_to(v, [W.shape[2]]) for v in input_norm]
+        W = W * scale.reshape([1, 1, -1, 1])
+
+        if same_padding:
+            a = a - (-shift / scale).astype(np.float32)  # 减去 mean
+            return W, b, a
+
+        b = 0.0 if b is None else b
+        return W, b + np.sum(W * (shift / scale).reshape([1, 1, -1, 1]), axis=(0, 1, 2)), a
+
+    ''' 将输入的 normalize 折叠进第一层 fc (输入 reshape 后逐个元素对应 W 的一行) '''
+
+    @staticmethod
+    def __fold_input_norm_fc(W, b, input_norm, input_shape):
+        if None in input_shape:
+            raise ValueError('input_shape must be fully defined to fold input normalization into fc')
+
+        scale, shift = [np.broadcast_to(v, input_shape).reshape([-1]) for v in input_norm]
+        return W * scale.reshape([-1, 1]), b + np.dot(shift, W)
+
     ''' 根据 name 获取 tensor 变量 '''
 
     def get_variable_by_name(self, name):
@@ -1148,6 +1353,68 @@ class NN:
         return tf.nn.batch_normalization(x, mean, variance,
                                          beta_dict[name_scope], gamma_dict[name_scope], self.BN_EPSILON)
 
+    '''
+     在图里对输入做 normalize: (x - mean) / (std + EPSILON)，mean、std 为每个通道的
+        X 可以直接是 uint8 的 placeholder，不需要在 numpy 里先转为 float64 再 normalize
+        t_is_train 为 True 时使用当前 batch 的 mean、std；self.t_input_update 用当前 batch 更新 running mean / std，
+            需要与 train_op 一起 run；每个 epoch 结束后调用 commit_input_moments 得到新的 mean_x、std_x
+        t_is_train 为 False 时使用 mean_x、std_x (None 时为 self.mean_x、self.std_x；restore 后重新建图即为保存的值)
+        batch 的 mean、std 只在 t_is_train 为 True 的分支以及 t_input_update 里计算，预测时不会计算
+     USE_BN_INPUT 只决定 mean_x、std_x 是否随模型保存 / restore，与原来在 numpy 里 normalize 时一致
+    '''
+
+    def normalize_input(self, X, mean_x=None, std_x=None):
+        x = tf.cast(X, tf.float32)
+        mean_x = self.mean_x if mean_x is None else mean_x
+        std_x = self.std_x if std_x is None else std_x
+
+        with tf.name_scope('normalize_input'):
+            channel = [x.get_shape().as_list()[-1]]
+            axis = list(range(len(x.get_shape()) - 1))
+
+            def moments():
+                mean, variance = tf.nn.moments(x, axis)
+                return mean, tf.sqrt(variance)
+
+            t_mean_x = tf.Variable(np.broadcast_to(np.asarray(mean_x, np.float32), channel), trainable=False,
+                                   name='mean_x')
+            t_std_x = tf.Variable(np.broadcast_to(np.asarray(std_x, np.float32), channel), trainable=False,
+                                  name='std_x')
+            running_mean = tf.Variable(np.zeros(channel, np.float32), trainable=False, name='running_mean')
+            running_std = tf.Variable(np.zeros(channel, np.float32), trainable=False, name='running_std')
+            steps = tf.Variable(0.0, trainable=False, name='steps')
+
+            # 更新 running mean / std；只有 run train_op 时才会计算
+            with tf.name_scope('update'):
+                batch_mean, batch_std = moments()
+
+                # 第一个 batch 直接使用该 batch 的 mean、std
+                moment = tf.minimum(steps, 1.0) * self.INPUT_MOMENT
+                update_list = [tf.assign(running_mean, moment * running_mean + (1 - moment) * batch_mean),
+                               tf.assign(running_std, moment * running_std + (1 - moment) * batch_std)]
+                with tf.control_dependencies(update_list):
+                    self.t_input_update = tf.assign_add(steps, 1.0)
+
+            self.__t_input_moments = [t_mean_x, t_std_x, running_mean, running_std]
+
+            mean, std = control_flow_ops.cond(self.t_is_train, moments, lambda: (t_mean_x, t_std_x))
+            return (x - mean) / (std + self.EPSILON)
+
+    '''
+     训练时每个 epoch 结束后调用: 把 running mean / std 作为之后 (t_is_train 为 False 时) 使用的 mean、std
+     std 乘以 batch_size / (batch_size - 1) 做无偏修正；返回 (mean_x, std_x)，由调用方保存到 self.mean_x、self.std_x
+    '''
+
+    def commit_input_moments(self, batch_size):
+        t_mean_x, t_std_x, running_mean, running_std = self.__t_input_moments
+
+        mean_x, std_x = self.sess.run([running_mean, running_std])
+        std_x = std_x * (batch_size / float(batch_size - 1))
+
+        t_mean_x.load(mean_x, self.sess)
+        t_std_x.load(std_x, self.sess)
+        return mean_x, std_x
+
     # *************************** 与 训练有关 的 常用函数 ***************************
 
     ''' 获取 train_op '''
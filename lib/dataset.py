@@ -0,0 +1,182 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+import os
+import json
+import numpy as np
+
+from lib.img import get_bbox, encode_rle, decode_rle
+
+'''
+ 数据集文件夹的索引 (文件列表)
+ 同一个文件夹只列一次文件、解析一次文件名，所有 Data (训练集、校验集、bi_vgg16_net 的 30 个网络 ...) 共用:
+    同一进程内按文件夹缓存；文件夹的 mtime 没变时直接使用缓存
+    索引保存在文件夹旁边的 <文件夹名>_index.json；签名 (文件夹的 mtime、文件数量) 不变时，下次运行直接读取
+ 每个文件为 [stem, file_name, no_list]；如 '3_12_0.jpg' -> ['3_12_0', '3_12_0.jpg', ['3', '12', '0']]
+ 用法:
+    index = FileIndex.get(DATA_ROOT)
+    for stem, file_name, no_list in index.get_list():
+        ...
+'''
+
+
+class FileIndex:
+    EXT = '.jpg'
+
+    __instances = {}  # 文件夹的绝对路径 -> FileIndex
+
+    def __init__(self, data_root):
+        self.__data_root = data_root
+        self.__index_path = os.path.normpath(data_root) + '_index.json'
+        self.__mtime = 0
+        self.__list = []
+        self.__memo = {}
+
+        self.__load()
+
+    ''' 获取文件夹的索引；文件夹有变化时重新建立 '''
+
+    @staticmethod
+    def get(data_root):
+        key = os.path.abspath(data_root)
+        index = FileIndex.__instances.get(key)
+        if index is None or index.__mtime != os.stat(data_root).st_mtime:
+            index = FileIndex(data_root)
+            FileIndex.__instances[key] = index
+        return index
+
+    ''' 读取保存的索引；签名不一致时重新列文件并保存 '''
+
+    def __load(self):
+        file_list = os.listdir(self.__data_root)
+        signature = {'mtime': os.stat(self.__data_root).st_mtime, 'count': len(file_list)}
+        self.__mtime = signature['mtime']
+
+        name_list = None
+        if os.path.isfile(self.__index_path):
+            try:
+                with open(self.__index_path, 'r') as f:
+                    saved = json.load(f)
+                if saved.get('signature') == signature:
+                    name_list = saved['file_list']
+            except ValueError:
+                name_list = None
+
+        if name_list is None:
+            name_list = [file_name for file_name in file_list if os.path.splitext(file_name)[1].lower() == self.EXT]
+            self.__save(signature, name_list)
+
+        for file_name in name_list:
+            stem = os.path.splitext(file_name)[0]
+            self.__list.append([stem, file_name, stem.split('_')])
+
+    ''' 保存索引；先写临时文件再替换，避免中断时留下写了一半的文件 '''
+
+    def __save(self, signature, name_list):
+        tmp_path = self.__index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'signature': signature, 'file_list': name_list}, f)
+
+            if os.path.isfile(self.__index_path):
+                os.remove(self.__index_path)
+            os.rename(tmp_path, self.__index_path)
+        except (IOError, OSError):
+            pass  # 没有写权限时只是下次需要重新列文件
+
+    ''' 文件夹路径 '''
+
+    def get_data_root(self):
+        return self.__data_root
+
+    '''
+     全部文件 [stem, file_name, no_list]；不要修改返回的 list
+     顺序与 os.listdir 一致 (与原来各个 Data 自己列文件时相同)
+     按列表位置划分数据集的结果不变；classify/load.py 的 Data 按原图分组后再划分 (见 get_source_group)
+    '''
+
+    def get_list(self):
+        return self.__list
+
+    '''
+     缓存基于索引计算的结果 (例如按猪分组)，同一个 key 只计算一次
+     func 的参数为 get_list() 的结果
+    '''
+
+    def memoize(self, key, func):
+        if key not in self.__memo:
+            self.__memo[key] = func(self.__list)
+        return self.__memo[key]
+
+
+'''
+ FCN 切割结果的索引 (get_image.py 生成，classify/img_arg.py 使用)
+ 保存在图片文件夹旁边的 <文件夹名>_pig.json；每张原图 (按 stem) 一条记录:
+    size: FCN 输入图片的大小 [w, h] (原图 resize 后的大小)，bbox、mask 都基于该大小
+    bbox: 框住猪的最小的框 [min_w, max_w, min_h, max_h] (与 lib/img.py 的 get_bbox 一致，闭区间)
+    rle:  bbox 裁剪后的 mask 的 run-length 编码 (lib/img.py 的 encode_rle)
+ 有了索引，裁剪猪时只需要解码原图一次，不需要再读取整幅的 _pig.jpg、也不需要逐像素找 bbox
+ 用法:
+    index = PigIndex(IMG_DIR)
+    index.update(records); index.save()
+    record = index.get(stem); pig_mask = PigIndex.get_mask(record)
+'''
+
+
+class PigIndex:
+    def __init__(self, img_dir):
+        self.__index_path = os.path.normpath(img_dir) + '_pig.json'
+        self.__records = {}
+
+        if os.path.isfile(self.__index_path):
+            with open(self.__index_path, 'r') as f:
+                self.__records = json.load(f)
+
+    ''' 索引是否存在 '''
+
+    def exist(self):
+        return os.path.isfile(self.__index_path)
+
+    ''' 全部记录的 stem '''
+
+    def get_list(self):
+        return list(self.__records.keys())
+
+    ''' 获取 stem 对应的记录；没有时返回 None '''
+
+    def get(self, stem):
+        return self.__records.get(stem)
+
+    ''' 添加 / 覆盖记录 (stem -> record)；需要调用 save 才会写入文件 '''
+
+    def update(self, records):
+        self.__records.update(records)
+
+    ''' 保存索引；先写临时文件再替换，避免中断时留下写了一半的文件 '''
+
+    def save(self):
+        tmp_path = self.__index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.__records, f, separators=(',', ':'))
+
+        if os.path.isfile(self.__index_path):
+            os.remove(self.__index_path)
+        os.rename(tmp_path, self.__index_path)
+
+    ''' 由 FCN 输出的 mask (去掉外部点点后的) 生成记录 '''
+
+    @staticmethod
+    def make_record(mask):
+        mask = np.asarray(mask) != 0
+        min_w, max_w, min_h, max_h = get_bbox(mask)
+        return {
+            'size': [int(mask.shape[1]), int(mask.shape[0])],
+            'bbox': [min_w, max_w, min_h, max_h],
+            'rle': encode_rle(mask[min_w: max_w + 1, min_h: max_h + 1]),
+        }
+
+    ''' 记录里 bbox 裁剪后的 mask；bool 的 (max_w - min_w + 1, max_h - min_h + 1) '''
+
+    @staticmethod
+    def get_mask(record):
+        min_w, max_w, min_h, max_h = record['bbox']
+        return decode_rle(record['rle'], (max_w - min_w + 1, max_h - min_h + 1))
@@ -0,0 +1,334 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+import random
+import numpy as np
+from PIL import Image
+from PIL import ImageEnhance
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None  # 没有 scipy 时 连通区域标记、闭运算、填补空洞 使用纯 numpy 的实现
+
+'''
+ 图片处理的常用函数 (与 DL 无关)
+'''
+
+'''
+ 用最小的框框住 mask 里非 0 的部分
+ mask 为 2 维 (h, w) 或 3 维 (h, w, c)，3 维时任一通道非 0 即算非 0
+ 返回 [min_w, max_w, min_h, max_h]；沿用 classify/img_arg.py 的叫法，w 为第 0 维，h 为第 1 维，区间为闭区间
+ mask 全为 0 时返回整幅图的范围
+'''
+
+
+def get_bbox(mask):
+    mask = np.asarray(mask)
+    return [int(v) for v in get_bbox_batch(mask[np.newaxis, ...])[0]]
+
+
+'''
+ get_bbox 的批量版本；masks 为 3 维 (n, h, w) 或 4 维 (n, h, w, c) (同一批 mask 的大小需要一致)
+ 返回 shape 为 (n, 4) 的 int 矩阵，每一行为对应 mask 的 [min_w, max_w, min_h, max_h]
+'''
+
+
+def get_bbox_batch(masks):
+    masks = np.asarray(masks)
+    if masks.ndim == 4:
+        masks = np.any(masks != 0, axis=3)
+    else:
+        masks = masks != 0
+
+    n, w, h = masks.shape
+    rows = np.any(masks, axis=2)  # (n, w): 该行是否有非 0
+    cols = np.any(masks, axis=1)  # (n, h): 该列是否有非 0
+
+    # argmax 返回第一个 True 的位置；反转后再 argmax 得到最后一个 True 的位置
+    bbox = np.stack([
+        np.argmax(rows, axis=1),
+        w - 1 - np.argmax(rows[:, ::-1], axis=1),
+        np.argmax(cols, axis=1),
+        h - 1 - np.argmax(cols[:, ::-1], axis=1),
+    ], axis=1)
+
+    empty = ~np.any(rows, axis=1)
+    bbox[empty] = [0, w - 1, 0, h - 1]
+    return bbox
+
+
+'''
+ 随机 data argument (在加载数据时实时做，不需要预先生成图片)
+ 变换的种类与参数与 classify/img_arg.py 预先生成的图片一致:
+    翻转 (水平 / 垂直)、亮度 / 色度 / 对比度 / 锐度 (增强 / 降低)、随机遮挡、随机裁剪
+ image 为 PIL 的 Image；返回新的 Image，不修改原图
+'''
+
+# [增强方法, 增强时的最大幅度, 降低时的最大幅度]
+ENHANCE_LIST = [
+    [ImageEnhance.Brightness, 0.8, 0.85],
+    [ImageEnhance.Color, 0.8, 0.7],
+    [ImageEnhance.Contrast, 0.55, 0.5],
+    [ImageEnhance.Sharpness, 2.0, 0.8],
+]
+
+
+def random_flip(image):
+    return image.transpose(random.choice([Image.FLIP_LEFT_RIGHT, Image.FLIP_TOP_BOTTOM]))
+
+
+def random_enhance(image):
+    enhance, up, down = random.choice(ENHANCE_LIST)
+    factor = 1 + random.random() * up if random.random() < 0.5 else 1 - random.random() * down
+    return enhance(image).enhance(factor)
+
+
+''' 随机遮挡；遮挡块的边长为图片边长的 1/12 - 1/8 '''
+
+
+def random_block(image):
+    np_image = np.array(image)
+    w, h = np_image.shape[:2]
+
+    ratio = 1.0 / random.randint(8, 12)
+    half_block_w = int(int(w * ratio) / 2)
+    half_block_h = int(int(h * ratio) / 2)
+
+    block_center_x = random.randrange(half_block_w, max(w - half_block_w, half_block_w + 1))
+    block_center_y = random.randrange(half_block_h, max(h - half_block_h, half_block_h + 1))
+
+    np_image[block_center_x - half_block_w: block_center_x + half_block_w,
+             block_center_y - half_block_h: block_center_y + half_block_h] = 0
+    return Image.fromarray(np_image)
+
+
+''' 随机裁剪；裁剪后的边长为原图的 30% - 80% '''
+
+
+def random_corp(image):
+    np_image = np.array(image)
+    w, h = np_image.shape[:2]
+
+    corp_w = max(int(float(random.randrange(3, 9)) / 10 * w), 1)
+    corp_h = max(int(float(random.randrange(3, 9)) / 10 * h), 1)
+
+    x1 = random.randrange(0, max(w - corp_w, 1))
+    y1 = random.randrange(0, max(h - corp_h, 1))
+
+    return Image.fromarray(np_image[x1: x1 + corp_w, y1: y1 + corp_h])
+
+
+# [权重, 变换]；权重为 img_arg.py 每张原图生成的各类图片的数量 (None 为原图)，使实时增强的分布与预先生成的一致
+AUGMENT_LIST = [
+    [1, None],
+    [2, random_flip],
+    [8, random_enhance],
+    [4, random_block],
+    [4, random_corp],
+]
+
+
+''' 按 AUGMENT_LIST 的权重随机选一种变换 '''
+
+
+def random_augment(image):
+    r = random.random() * sum([weight for weight, _ in AUGMENT_LIST])
+    for weight, transform in AUGMENT_LIST:
+        r -= weight
+        if r < 0:
+            return transform(image) if transform else image
+    return image
+
+
+'''
+ 将图片补黑边到宽高比为 ratio，再 resize 成 resize ([w, h])；宽高比与 ratio 相差不超过 0.1 时直接 resize
+ 返回 uint8 的 np.array (h, w, c)；classify 里各个加载数据的类以及图片缓存共用
+'''
+
+
+def pad_image(image, resize, ratio=1.0):
+    w, h = image.size
+    image_ratio = float(w) / h
+
+    if abs(image_ratio - ratio) <= 0.1:
+        return np.array(image.resize(resize))
+
+    np_image = np.array(image)
+    h, w, c = np_image.shape
+
+    if image_ratio > ratio:
+        new_h = int(float(w) / ratio)
+        padding = int((new_h - h) / 2.0)
+
+        np_new_image = np.zeros([new_h, w, c], np.uint8)
+        np_new_image[padding: padding + h, :, :] = np_image
+
+    else:
+        new_w = int(float(h) * ratio)
+        padding = int((new_w - w) / 2.0)
+
+        np_new_image = np.zeros([h, new_w, c], np.uint8)
+        np_new_image[:, padding: padding + w, :] = np_image
+
+    return np.array(Image.fromarray(np_new_image).resize(resize))
+
+
+'''
+ run-length 编码 bool mask (一般为 get_bbox 裁剪后的 mask)：按行优先展开，依次记录 0、1、0、1 ... 连续的长度
+ 第一个长度为 0 的个数 (mask[0, 0] 非 0 时为 0)；返回 int 的 list，可直接保存为 json
+'''
+
+
+def encode_rle(mask):
+    flat = (np.asarray(mask) != 0).ravel()
+    if not len(flat):
+        return []
+
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], change, [len(flat)]]))
+    if flat[0]:
+        counts = np.concatenate([[0], counts])
+    return [int(v) for v in counts]
+
+
+''' encode_rle 的逆运算；shape 为 (h, w)，返回 bool 的 (h, w) '''
+
+
+def decode_rle(counts, shape):
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape(shape)
+
+
+'''
+ 给 mask 里非 0 的点标记 4 连通区域
+ 返回 (labels, sizes): labels 为 int32 的 (h, w)，0 为背景，区域从 1 开始编号 (按区域里行优先的第一个点排序)；
+    sizes[i] 为第 i 个区域的面积 (sizes[0] 为 0)
+ 有 scipy 时使用 ndimage.label；否则把每行连续的非 0 点看作一段，相邻两行有重叠的段合并 (union-find)，全部为 numpy 运算
+'''
+
+
+def label_components(mask):
+    mask = np.asarray(mask) != 0
+    h, w = mask.shape
+
+    if ndimage is not None:
+        labels, num = ndimage.label(mask)  # 默认的 structure 即为 4 连通
+        labels = labels.astype(np.int32)
+        sizes = np.bincount(labels.ravel(), minlength=num + 1)
+        sizes[0] = 0
+        return labels, sizes
+
+    row, start, end = _get_runs(mask)
+    _, run_label = np.unique(_union_runs(row, start, end, w), return_inverse=True)
+    run_label = run_label + 1
+
+    # 每段的代表为区域里最小的段号，np.unique 后的编号顺序与 ndimage.label 一致
+    sizes = np.bincount(run_label, weights=end - start, minlength=1).astype(np.int64)
+
+    # 用差分把每段的编号画回 mask (同一行的段互不重叠)
+    diff = np.zeros([h, w + 1], np.int32)
+    np.add.at(diff, (row, start), run_label)
+    np.add.at(diff, (row, end), -run_label)
+    return np.cumsum(diff, axis=1)[:, :w].astype(np.int32), sizes
+
+
+'''
+ 形态学闭运算 (先膨胀再腐蚀)，结构元素为 size * size 的正方形；图片边界外视为 0 (与 ndimage.binary_closing 一致)
+ 返回 bool 的 (h, w)
+'''
+
+
+def close_mask(mask, size=3):
+    mask = np.asarray(mask) != 0
+    if ndimage is not None:
+        return ndimage.binary_closing(mask, np.ones([size, size], bool))
+    return _erode(_dilate(mask, size), size)
+
+
+'''
+ 填补 mask 里的空洞 (不与图片边界 4 连通的背景)；返回 bool 的 (h, w)
+'''
+
+
+def fill_holes(mask):
+    mask = np.asarray(mask) != 0
+    if ndimage is not None:
+        return ndimage.binary_fill_holes(mask)
+
+    labels, _ = label_components(~mask)
+    border = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    return mask | ((labels != 0) & ~np.isin(labels, border))
+
+
+''' 膨胀 / 腐蚀；size * size 的正方形，中心与 ndimage 一致 (偶数时腐蚀偏左上、膨胀偏右下，闭运算后不会整体平移) '''
+
+
+def _shift_reduce(mask, size, func, offset_list):
+    h, w = mask.shape
+    padded = np.pad(mask, size, 'constant')
+
+    result = None
+    for dy in offset_list:
+        for dx in offset_list:
+            shifted = padded[size + dy: size + dy + h, size + dx: size + dx + w]
+            result = shifted.copy() if result is None else func(result, shifted)
+    return result
+
+
+def _dilate(mask, size):
+    return _shift_reduce(mask, size, np.logical_or, range(-(size - 1 - size // 2), size // 2 + 1))
+
+
+def _erode(mask, size):
+    return _shift_reduce(mask, size, np.logical_and, range(-(size // 2), size - size // 2))
+
+
+''' 每行连续为 True 的段；返回 (行, 起点, 终点 (不含))，按 行、起点 排序 '''
+
+
+def _get_runs(mask):
+    h, w = mask.shape
+    padded = np.zeros([h, w + 2], np.int8)
+    padded[:, 1: -1] = mask
+
+    d = np.diff(padded, axis=1)
+    row, start = np.nonzero(d == 1)
+    _, end = np.nonzero(d == -1)
+    return row, start, end
+
+
+''' 合并相邻两行有重叠 (4 连通) 的段；返回每段所属连通区域的代表 (区域里最小的段号) '''
+
+
+def _union_runs(row, start, end, w):
+    n = len(row)
+    parent = np.arange(n)
+
+    # 下一行里与第 i 段重叠的段为连续的一块 [lo, hi)
+    start_key = row * (w + 1) + start
+    end_key = row * (w + 1) + end
+    lo = np.searchsorted(end_key, (row + 1) * (w + 1) + start, 'right')
+    hi = np.searchsorted(start_key, (row + 1) * (w + 1) + end, 'left')
+
+    count = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(n), count)
+    b = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(lo, count)
+
+    while len(a):
+        pa = parent[a]
+        pb = parent[b]
+        if np.array_equal(pa, pb):
+            break
+
+        root = np.minimum(pa, pb)
+        np.minimum.at(parent, pa, root)
+        np.minimum.at(parent, pb, root)
+
+        # 路径压缩，直到每段都直接指向代表
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+    return parent
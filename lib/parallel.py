@@ -0,0 +1,71 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+import random
+import multiprocessing
+import numpy as np
+
+'''
+ 用进程池并行处理一批互相独立的任务 (例如 data argument，每张图片一个任务)
+ 随机种子:
+    seed 不为 None 时，第 i 个任务开始前把 random 与 np.random 的种子设为 seed + i
+    种子跟着任务走，而不是跟着进程走，所以结果与 进程数、chunk_size、任务被分到哪个进程 都无关，
+    num_workers = 1 (在当前进程运行) 与多进程的输出也完全一样
+ 任务分发:
+    按 chunk_size 个任务一组分发给子进程，减少进程间通信的次数；None 时根据任务数与进程数自动计算
+ 进度:
+    子进程只返回结果，进度由调用方在主进程根据返回的结果统计
+ 进程:
+    context 为 multiprocessing 的 context (如 multiprocessing.get_context('spawn'))，None 时使用默认的方式 (linux 为 fork)
+    max_tasks_per_child 为每个子进程最多运行的任务数，之后换新的子进程 (例如每个任务都占用大量内存、需要释放时)
+ 用法:
+    for index, result in imap_tasks(func, task_list, num_workers, seed):
+        ...
+ func 需要定义在模块层 (能被 pickle)；使用的脚本需要放在 if __name__ == '__main__' 里运行
+'''
+
+
+def _set_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed % (2 ** 32))
+
+
+def _run_task(args):
+    func, index, seed, task = args
+    if seed is not None:
+        _set_seed(seed + index)
+    return index, func(task)
+
+
+def _get_chunk_size(task_num, num_workers):
+    # 每个进程大约分到 4 组任务，兼顾通信次数与负载均衡
+    return max(1, min(64, task_num // (num_workers * 4)))
+
+
+'''
+ 按完成的顺序返回 (任务的序号, func(task)) ；子进程的异常会在主进程重新抛出
+'''
+
+
+def imap_tasks(func, task_list, num_workers=None, seed=None, chunk_size=None, context=None,
+               max_tasks_per_child=None):
+    task_list = list(task_list)
+    num_workers = num_workers or multiprocessing.cpu_count()
+    args_list = [(func, i, seed, task) for i, task in enumerate(task_list)]
+
+    if num_workers <= 1 or len(task_list) <= 1:
+        for args in args_list:
+            yield _run_task(args)
+        return
+
+    chunk_size = chunk_size or _get_chunk_size(len(task_list), num_workers)
+    pool = (context or multiprocessing).Pool(min(num_workers, len(task_list)), maxtasksperchild=max_tasks_per_child)
+
+    try:
+        for result in pool.imap_unordered(_run_task, args_list, chunk_size):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
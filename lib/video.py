@@ -0,0 +1,174 @@
+#!/usr/bin/Python
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+'''
+ 视频抽帧
+ 只对需要保留的帧做完整解码:
+    顺序读取时用 cap.grab() 跳过不需要的帧 (只解复用，不转换成图像)，需要的帧再 cap.retrieve()
+    seek=True 时直接按 帧序号 / 时间戳 跳到需要的帧 (关键帧稀疏的视频 seek 反而更慢，默认不用)
+ 支持两种抽帧方式:
+    'frame': 每 frame_stride 帧取一帧，取的是第 frame_stride, 2 * frame_stride, ... 帧 (从 0 开始计)
+    'time':  每 time_interval 秒取一帧，取的是 time_interval, 2 * time_interval, ... 秒处的帧
+ 用法:
+    sampler = FrameSampler(video_path, 'time', time_interval=0.5)
+    for frame_index, frame in sampler:
+        ...
+    sampler.close()
+'''
+
+
+class FrameSampler:
+    MODE_FRAME = 'frame'
+    MODE_TIME = 'time'
+
+    def __init__(self, video_path, mode=MODE_FRAME, frame_stride=29, time_interval=0.5, seek=False):
+        if mode not in (self.MODE_FRAME, self.MODE_TIME):
+            raise ValueError('mode must be "%s" or "%s", got "%s"' % (self.MODE_FRAME, self.MODE_TIME, mode))
+
+        self.__mode = mode
+        self.__frame_stride = max(int(frame_stride), 1)
+        self.__time_interval = float(time_interval)
+        self.__seek = seek
+
+        self.__cap = cv2.VideoCapture(video_path)
+        if not self.__cap.isOpened():
+            self.__cap.open(video_path)
+
+        self.__frame_num = int(self.__cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.__fps = self.__cap.get(cv2.CAP_PROP_FPS)
+
+    ''' 视频的总帧数 (由容器头部给出，可能不准确) '''
+    def get_frame_num(self):
+        return self.__frame_num
+
+    ''' 视频的帧率 '''
+    def get_fps(self):
+        return self.__fps
+
+    def __iter__(self):
+        if self.__seek:
+            return self.__seek_frames()
+        return self.__grab_frames()
+
+    ''' 顺序 grab，只 retrieve 需要的帧 '''
+    def __grab_frames(self):
+        next_time = self.__time_interval * 1000.0   # 下一帧需要取的时间戳 (ms)
+        index = -1
+
+        while self.__cap.grab():
+            index += 1
+
+            if self.__mode == self.MODE_FRAME:
+                if index == 0 or index % self.__frame_stride != 0:
+                    continue
+            else:
+                if self.__cap.get(cv2.CAP_PROP_POS_MSEC) < next_time:
+                    continue
+                next_time += self.__time_interval * 1000.0
+
+            ret, frame = self.__cap.retrieve()
+            if ret:
+                yield index, frame
+
+    ''' 按 帧序号 / 时间戳 seek 到需要的帧 '''
+    def __seek_frames(self):
+        k = 1
+        while True:
+            if self.__mode == self.MODE_FRAME:
+                index = k * self.__frame_stride
+                if 0 < self.__frame_num <= index:
+                    break
+                self.__cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            else:
+                self.__cap.set(cv2.CAP_PROP_POS_MSEC, k * self.__time_interval * 1000.0)
+
+            index = int(self.__cap.get(cv2.CAP_PROP_POS_FRAMES))
+            ret, frame = self.__cap.read()
+            if not ret:
+                break
+
+            yield index, frame
+            k += 1
+
+    ''' 释放视频 '''
+    def close(self):
+        self.__cap.release()
+
+
+'''
+ 近似重复帧过滤
+ 与该视频上一张保留的帧比较，差异小于阈值则认为是重复帧 (例如猪一直站着不动)
+ 支持两种比较方式:
+    'hash': difference hash；缩小成 (hash_size + 1) * hash_size 的灰度图，比较相邻像素得到 hash，按 hamming 距离比较
+    'diff': 缩小成 diff_size 的灰度图，按像素的平均绝对差比较
+ 用法:
+    dup_filter = DupFilter('hash', 5)
+    if not dup_filter.is_dup(frame):
+        save(frame)
+'''
+
+
+class DupFilter:
+    METHOD_HASH = 'hash'
+    METHOD_DIFF = 'diff'
+
+    DEFAULT_THRESHOLD = {
+        METHOD_HASH: 5,  # hamming 距离 (共 hash_size * hash_size 位)
+        METHOD_DIFF: 4.0,  # 灰度的平均绝对差 (0 - 255)
+    }
+
+    def __init__(self, method=METHOD_HASH, threshold=None, hash_size=8, diff_size=(32, 18)):
+        if method not in self.DEFAULT_THRESHOLD:
+            raise ValueError('method must be "%s" or "%s", got "%s"' % (self.METHOD_HASH, self.METHOD_DIFF, method))
+
+        self.__method = method
+        self.__threshold = self.DEFAULT_THRESHOLD[method] if threshold is None else threshold
+        self.__hash_size = hash_size
+        self.__diff_size = tuple(diff_size)
+
+        self.__last_feature = None  # 上一张保留的帧的特征
+        self.__total = 0
+        self.__drop = 0
+
+    ''' 计算帧的特征 '''
+    def __get_feature(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else frame
+
+        if self.__method == self.METHOD_HASH:
+            small = cv2.resize(gray, (self.__hash_size + 1, self.__hash_size), interpolation=cv2.INTER_AREA)
+            return small[:, 1:] > small[:, :-1]
+
+        small = cv2.resize(gray, self.__diff_size, interpolation=cv2.INTER_AREA)
+        return small.astype(np.int16)
+
+    ''' 判断是否为重复帧；不是重复帧时，该帧成为新的比较对象 '''
+    def is_dup(self, frame):
+        self.__total += 1
+        feature = self.__get_feature(frame)
+
+        if self.__last_feature is not None:
+            if self.__method == self.METHOD_HASH:
+                distance = np.count_nonzero(feature != self.__last_feature)
+            else:
+                distance = np.mean(np.abs(feature - self.__last_feature))
+
+            if distance <= self.__threshold:
+                self.__drop += 1
+                return True
+
+        self.__last_feature = feature
+        return False
+
+    ''' 比较过的帧数 '''
+    def get_total(self):
+        return self.__total
+
+    ''' 丢弃的帧数 '''
+    def get_drop(self):
+        return self.__drop
+
+    ''' 丢弃率 '''
+    def get_drop_rate(self):
+        return float(self.__drop) / self.__total if self.__total else 0.0
@@ -1,22 +1,27 @@
 #!/usr/bin/Python
 # -*- coding: utf-8 -*-
+from __future__ import print_function
 import os
 import sys
 
 # 将运行路径切换到当前文件所在路径
-cur_dir_path = os.path.split(__file__)[0]
+cur_dir_path = os.path.abspath(os.path.split(__file__)[0])
 if cur_dir_path:
     os.chdir(cur_dir_path)
     sys.path.append(cur_dir_path)
+    sys.path.append(os.path.split(cur_dir_path)[0])
 
 import cv2
 import random
+import multiprocessing
 import numpy as np
 
 import copy
 from PIL import Image
 from PIL import ImageEnhance
 
+from lib.parallel import imap_tasks
+
 
 class Img:
     IMG_PATH = r'../data/TrainImg'
@@ -26,6 +31,12 @@ class Img:
     NUM_BLOCK_IMAGE = 4
     NUM_CORP_IMAGE = 4
     MIN_BLOCK_PIG_RATIO = 0.35
+    MIN_CORP_PIG_RATIO = 0.4
+    MAX_TRY_TIMES = 100     # 随机遮挡、随机裁剪 最多尝试的次数
+
+    NUM_WORKERS = multiprocessing.cpu_count()   # 并行生成图片的进程数；为 1 时在当前进程逐张处理
+    RANDOM_SEED = 0                             # 第 i 张图片使用的随机种子为 RANDOM_SEED + i；None 时不固定
+    CHUNK_SIZE = None                           # 每次分发给子进程的图片数；None 时自动计算
 
     def __init__(self):
         self.__imgList = []
@@ -63,81 +74,70 @@ class Img:
         self.__progressLen = len(self.__imgList) * (self.NUM_TRANSFORM + self.NUM_BLOCK_IMAGE + self.NUM_CORP_IMAGE)
 
 
-    def __getSmallPig(self, image):
+    ''' 缩小到只包含猪的区域；sat 为整幅图猪像素的积分图 '''
+    def __getSmallPig(self, image, sat):
         np_img = np.array(image)
         w, h, c = np_img.shape
+        ratio = lambda x0, x1, y0, y1: self.__calRectRatio(sat, x0, x1, y0, y1)
 
         left_cut = int(0.5 * w)
-        cut_img = np_img[:left_cut, :, :]
-        cut_border_img = np_img[left_cut - 10: left_cut, :, :]
-        while left_cut > 10 and (self.__calPigRatio(cut_img) > 0.1 or self.__calPigRatio(cut_border_img) > 0.01):
+        while left_cut > 10 and (ratio(None, left_cut, None, None) > 0.1 or
+                                 ratio(left_cut - 10, left_cut, None, None) > 0.01):
             left_cut = int(left_cut * 0.5)
-            cut_img = np_img[:left_cut, :, :]
-            cut_border_img = np_img[left_cut - 10: left_cut, :, :]
 
         right_cut = int(0.5 * w) - 1
-        cut_img = np_img[right_cut:, :, :]
-        cut_border_img = np_img[right_cut: right_cut + 10, :, :]
-        while right_cut < w - 10 and (self.__calPigRatio(cut_img) > 0.1 or self.__calPigRatio(cut_border_img) > 0.01):
+        while right_cut < w - 10 and (ratio(right_cut, None, None, None) > 0.1 or
+                                      ratio(right_cut, right_cut + 10, None, None) > 0.01):
             right_cut = int( (right_cut + w - 1) * 0.5 )
-            cut_img = np_img[right_cut:, :, :]
-            cut_border_img = np_img[right_cut: right_cut + 10, :, :]
 
         top_cut = int(0.5 * h)
-        cut_img = np_img[:, : top_cut, :]
-        cut_border_img = np_img[: , top_cut - 10: top_cut, :]
-        while top_cut > 10 and (self.__calPigRatio(cut_img) > 0.1 or self.__calPigRatio(cut_border_img) > 0.01):
+        while top_cut > 10 and (ratio(None, None, None, top_cut) > 0.1 or
+                                ratio(None, None, top_cut - 10, top_cut) > 0.01):
             top_cut = int(top_cut * 0.5)
-            cut_img = np_img[:, :top_cut, :]
-            cut_border_img = np_img[:, top_cut - 10: top_cut, :]
 
         bottom_cut = int(0.5 * h) - 1
-        cut_img = np_img[:, bottom_cut:, :]
-        cut_border_img = np_img[:, bottom_cut: bottom_cut + 10, :]
-        while bottom_cut < h - 10 and (self.__calPigRatio(cut_img) > 0.1 or self.__calPigRatio(cut_border_img) > 0.01):
+        while bottom_cut < h - 10 and (ratio(None, None, bottom_cut, None) > 0.1 or
+                                       ratio(None, None, bottom_cut, bottom_cut + 10) > 0.01):
             bottom_cut = int( (bottom_cut + h - 1) * 0.5)
-            cut_img = np_img[:, bottom_cut:, :]
-            cut_border_img = np_img[:, bottom_cut: bottom_cut + 10, :]
 
         small_img = np_img[left_cut: right_cut, top_cut: bottom_cut, :]
         return Image.fromarray( small_img )
 
 
-    def __randomCorp(self, np_image):
+    ''' 随机裁剪；一次生成 MAX_TRY_TIMES + 1 个候选框，取第一个猪的占比不低于 MIN_CORP_PIG_RATIO 的 '''
+    def __randomCorp(self, np_image, sat):
         w, h, c = np_image.shape
+        num = self.MAX_TRY_TIMES + 1
 
-        def __corpImg():
-            corp_w = int( float(random.randrange(3, 9)) / 10 * w)
-            corp_h = int( float(random.randrange(3, 9)) / 10 * h)
-
-            x1 = random.randrange(0, int(w - corp_w))
-            y1 = random.randrange(0, int(h - corp_h))
+        corp_w = (np.random.randint(3, 9, num) / 10.0 * w).astype(np.int64)
+        corp_h = (np.random.randint(3, 9, num) / 10.0 * h).astype(np.int64)
 
-            return np_image[x1: x1 + corp_w, y1: y1 + corp_h, :]
+        x1 = (np.random.random(num) * (w - corp_w)).astype(np.int64)
+        y1 = (np.random.random(num) * (h - corp_h)).astype(np.int64)
 
-        try_times = 0
-        corp_image = __corpImg()
-        while self.__calPigRatio(corp_image) < 0.4 and try_times < 100:
-            try_times += 1
-            corp_image = __corpImg()
+        ratio = self.__calRectRatio(sat, x1, x1 + corp_w, y1, y1 + corp_h)
+        i = self.__firstIndex(ratio >= self.MIN_CORP_PIG_RATIO)
 
-        return Image.fromarray(corp_image)
+        return Image.fromarray(np_image[x1[i]: x1[i] + corp_w[i], y1[i]: y1[i] + corp_h[i], :])
 
 
-    ''' 制造更多图片 '''
-    def __getMoreImg(self, img_path):
+    ''' 制造更多图片；供子进程调用，返回图片的名字 '''
+    def getMoreImg(self, img_path):
         im_name = os.path.splitext(os.path.split(img_path)[1])[0]
-        self.__calProgress(im_name, self.NUM_TRANSFORM + self.NUM_BLOCK_IMAGE + self.NUM_CORP_IMAGE)
 
         image = Image.open(img_path)
 
+        # 每张图只计算一次猪的 mask 以及积分图，之后任意矩形内猪的占比都是 O(1) 查表
+        np_image = np.array(image)
+        sat = self.__getSat(self.__getPigMask(np_image))
+
         # 保存原图
         file_no = 0
         image.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
         # 小图
         file_no += 1
-        small_image = self.__getSmallPig(image)
+        small_image = self.__getSmallPig(image, sat)
         small_image.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
         # 水平翻转
@@ -211,79 +211,110 @@ class Img:
         image_sharped.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
         # 遮挡
-        np_image = np.array(image)
         for i in range(self.NUM_BLOCK_IMAGE):
-            block_image = Image.fromarray( self.__getBlockImg(copy.deepcopy(np_image)) )
+            block_image = Image.fromarray( self.__getBlockImg(copy.deepcopy(np_image), sat) )
 
             file_no += 1
             block_image.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
         # 随机裁剪图片
         for i in range(self.NUM_CORP_IMAGE):
-            corp_image = self.__randomCorp(np_image)
+            corp_image = self.__randomCorp(np_image, sat)
             file_no += 1
             corp_image.save(os.path.join(self.IMG_MORE_PATH, '%s_%d.jpg' % (im_name, file_no)))
 
+        return im_name
+
 
-    def __getBlockImg(self, block_image, times = 100):
+    ''' 随机遮挡；一次生成 MAX_TRY_TIMES + 1 个候选块，取第一个猪的占比不低于 MIN_BLOCK_PIG_RATIO 的 '''
+    def __getBlockImg(self, block_image, sat):
         w, h, c = block_image.shape
+        num = self.MAX_TRY_TIMES + 1
 
-        def __getImg():
-            ratio = 1.0 / random.randint(7, 12)
-            block_w = int(w * ratio)
-            block_h = int(h * ratio)
+        ratio = 1.0 / np.random.randint(7, 13, num)
+        half_block_w = (w * ratio).astype(np.int64) // 2
+        half_block_h = (h * ratio).astype(np.int64) // 2
 
-            _half_block_w = int(block_w / 2)
-            _half_block_h = int(block_h / 2)
+        block_center_x = half_block_w + (np.random.random(num) * (w - 2 * half_block_w)).astype(np.int64)
+        block_center_y = half_block_h + (np.random.random(num) * (h - 2 * half_block_h)).astype(np.int64)
 
-            _block_center_x = random.randrange(_half_block_w, w - _half_block_w)
-            _block_center_y = random.randrange(_half_block_h, h - _half_block_h)
+        pig_ratio = self.__calRectRatio(sat, block_center_x - half_block_w, block_center_x + half_block_w,
+                                        block_center_y - half_block_h, block_center_y + half_block_h)
+        i = self.__firstIndex(pig_ratio >= self.MIN_BLOCK_PIG_RATIO)
 
-            _block_content = block_image[_block_center_x - _half_block_w: _block_center_x + _half_block_w,
-                            _block_center_y - _half_block_h: _block_center_y + _half_block_h, :]
+        block_image[block_center_x[i] - half_block_w[i]: block_center_x[i] + half_block_w[i],
+        block_center_y[i] - half_block_h[i]: block_center_y[i] + half_block_h[i], :] = np.array([0, 0, 0], np.int8)
+        return block_image
 
-            return _block_content, _block_center_x, _block_center_y, _half_block_w, _half_block_h
 
-        block_content, block_center_x, block_center_y, half_block_w, half_block_h = __getImg()
-        while self.__calPigRatio(block_content) < self.MIN_BLOCK_PIG_RATIO and times > 0:
-            times -= 1
-            block_content, block_center_x, block_center_y, half_block_w, half_block_h = __getImg()
+    ''' 第一个为 True 的位置；都为 False 时取最后一个 (与原来尝试 MAX_TRY_TIMES 次后放弃一致) '''
+    @staticmethod
+    def __firstIndex(condition):
+        index = np.nonzero(condition)[0]
+        return int(index[0]) if len(index) else len(condition) - 1
 
-        block_image[block_center_x - half_block_w: block_center_x + half_block_w,
-        block_center_y - half_block_h: block_center_y + half_block_h, :] = np.array([0, 0, 0], np.int8)
-        return block_image
+
+    ''' 判断每个像素是否为猪 (去掉背景色)；返回 bool 矩阵 '''
+    @staticmethod
+    def __getPigMask(np_image):
+        im = np_image[:, :, :3].astype(np.float64)
+        r = im[:, :, 0]
+        g = im[:, :, 1]
+        b = im[:, :, 2]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g_b = g / b     # b < 35 时已经是背景，除以 0 的结果不影响判断
+            r_g = r / g
+
+            background = ((80 < r) & (r < 96) & (70 < g) & (g < 80) & (65 < b) & (b < 80)) \
+                | ((145 < r) & (r < 155) & (115 < g) & (g < 121) & (100 < b) & (b < 115)) \
+                | ((141 < r) & (r < 147) & (113 < g) & (g < 118) & (112 < b) & (b < 120)) \
+                | ((114 < r) & (r < 120) & (94 < g) & (g < 100) & (94 < b) & (b < 100)) \
+                | ((52 < r) & (r < 60) & (40 < g) & (g < 50) & (40 < b) & (b < 50)) \
+                | ((95 < r) & (r < 105) & (82 < g) & (g < 89) & (78 < b) & (b < 85)) \
+                | ((123 < r) & (r < 131) & (106 < g) & (g < 113) & (95 < b) & (b < 103)) \
+                | (b < 35) | (g < 45) | (r < 40) | (r > 252) \
+                | (g > 225) | (b > 215) | (g_b > 1.17) | (g_b < 0.8) \
+                | (r_g > 3.1) | ((2 > r_g) & (r_g > 1.45)) | (r_g < 1.05)
+
+        return ~background
+
+
+    ''' 猪像素的积分图 (summed-area table)；sat[i, j] 为 mask[:i, :j] 中猪像素的数量 '''
+    @staticmethod
+    def __getSat(pig_mask):
+        w, h = pig_mask.shape
+        sat = np.zeros([w + 1, h + 1], np.int64)
+        sat[1:, 1:] = np.cumsum(np.cumsum(pig_mask, axis=0), axis=1)
+        return sat
 
 
+    '''
+     根据积分图 O(1) 计算 im[x0: x1, y0: y1] 中猪的占比
+     参数与 python 切片的语义一致 (可以为 None 或负数)；x0, x1, y0, y1 也可以是等长的 np.array，此时一次算出所有矩形
+    '''
     @staticmethod
-    def __calPigRatio(im):
-        w, h, c = im.shape
-        im_size = w * h
-
-        real_size = 0
-        for i, val_i in enumerate(im):
-            for j, val_j in enumerate(val_i):
-                r = float(val_j[0])
-                g = float(val_j[1])
-                b = float(val_j[2])
-
-                if (80 < r < 96 and 70 < g < 80 and 65 < b < 80) \
-                        or (145 < r < 155 and 115 < g < 121 and 100 < b < 115) \
-                        or (141 < r < 147 and 113 < g < 118 and 112 < b < 120) \
-                        or (114 < r < 120 and 94 < g < 100 and 94 < b < 100) \
-                        or (52 < r < 60 and 40 < g < 50 and 40 < b < 50) \
-                        or (95 < r < 105 and 82 < g < 89 and 78 < b < 85) \
-                        or (123 < r < 131 and 106 < g < 113 and 95 < b < 103) \
-                        or b < 35 or g < 45 or r < 40 or r > 252 \
-                        or g > 225 or b > 215 or g / b > 1.17 or g / b < 0.8 \
-                        or r / g > 3.1 or 2 > r / g > 1.45 or r / g < 1.05:
-                    pass
-                else:
-                    real_size += 1
-
-        return float(real_size) / im_size
-
-
-    ''' 获取进度 '''
+    def __calRectRatio(sat, x0, x1, y0, y1):
+        w = sat.shape[0] - 1
+        h = sat.shape[1] - 1
+
+        def __bound(start, stop, size):
+            if isinstance(start, np.ndarray) or isinstance(stop, np.ndarray):
+                start = np.clip(np.where(start < 0, start + size, start), 0, size)
+                stop = np.clip(np.where(stop < 0, stop + size, stop), 0, size)
+                return start, np.maximum(stop, start)
+            start, stop, _ = slice(start, stop).indices(size)
+            return start, max(stop, start)
+
+        x0, x1 = __bound(x0, x1, w)
+        y0, y1 = __bound(y0, y1, h)
+
+        real_size = sat[x1, y1] - sat[x0, y1] - sat[x1, y0] + sat[x0, y0]
+        im_size = (x1 - x0) * (y1 - y0)
+        return np.where(im_size > 0, real_size / np.maximum(im_size, 1).astype(np.float64), 0.0)
+
+
+    ''' 获取进度；在主进程根据已完成的图片统计 '''
     def __calProgress(self, img_name, increment = 1):
         self.__progressIndex += increment
         progress = float(self.__progressIndex) / self.__progressLen * 100
@@ -294,7 +325,7 @@ class Img:
     @staticmethod
     def echo(msg, crlf=True):
         if crlf:
-            print msg
+            print(msg)
         else:
             sys.stdout.write(msg)
             sys.stdout.flush()
@@ -304,11 +335,18 @@ class Img:
         self.__getAlreadyExistList()
         self.__getImgList()
 
-        for i, img_path in enumerate(self.__imgList):
-            self.__getMoreImg(img_path)
+        for _, im_name in imap_tasks(_getMoreImg, self.__imgList, self.NUM_WORKERS, self.RANDOM_SEED,
+                                     self.CHUNK_SIZE):
+            self.__calProgress(im_name, self.NUM_TRANSFORM + self.NUM_BLOCK_IMAGE + self.NUM_CORP_IMAGE)
+
+        self.echo('\ndone')
+
 
-        self.echo('done')
+''' 进程池的任务函数；需要定义在模块层，才能被 pickle '''
+def _getMoreImg(img_path):
+    return Img().getMoreImg(img_path)
 
 
-o_img = Img()
-o_img.run()
+if __name__ == '__main__':
+    o_img = Img()
+    o_img.run()
@@ -1,15 +1,25 @@
 #!/usr/bin/Python
 # -*- coding: utf-8 -*-
+from __future__ import print_function
 import os
 import sys
+import json
+import multiprocessing
+
+if '2.7' in sys.version:
+    import Queue as queue
+else:
+    import queue
 
 # 将运行路径切换到当前文件所在路径
-cur_dir_path = os.path.split(__file__)[0]
+cur_dir_path = os.path.abspath(os.path.split(__file__)[0])
 if cur_dir_path:
     os.chdir(cur_dir_path)
     sys.path.append(cur_dir_path)
+    sys.path.append(os.path.split(cur_dir_path)[0])
 
 import cv2
+from lib.video import FrameSampler, DupFilter
 
 
 '''
@@ -21,73 +31,278 @@ class Transformer:
 
     IMG_PER_FRAME = 29
 
+    SAMPLE_MODE = FrameSampler.MODE_FRAME   # 'frame': 每 IMG_PER_FRAME 帧取一帧; 'time': 每 TIME_INTERVAL 秒取一帧
+    TIME_INTERVAL = 0.5                     # SAMPLE_MODE 为 'time' 时的取帧间隔 (秒)
+    USE_SEEK = False                        # 是否直接 seek 到需要的帧；默认顺序 grab 跳过不需要的帧
+
+    USE_DEDUP = False                       # 是否丢弃与该视频上一张保留的帧近似重复的帧
+    DEDUP_METHOD = DupFilter.METHOD_HASH    # 'hash': difference hash; 'diff': 缩小后灰度图的平均绝对差
+    DEDUP_THRESHOLD = None                  # 差异不超过该值即为重复帧；None 时使用 DupFilter 的默认值
+
+    MANIFEST_PATH = IMG_PATH + '_manifest.json'  # 记录每个视频的抽帧情况；没有变化的视频下次运行时直接跳过
+
+    NUM_WORKERS = multiprocessing.cpu_count()   # 并行处理视频的进程数；为 1 时在当前进程逐个处理
+    MAX_IN_FLIGHT = None                        # 同时提交给进程池的视频数量上限；None 时为 2 * NUM_WORKERS
+
     def __init__(self):
         self.__videoList = []   # 存放视频的路径
+        self.__manifest = {}    # video 文件名 -> 该视频的 size、mtime、抽帧参数、输出的图片数量
+        self.__report = []      # 本次运行每个视频的抽帧结果
 
 
-    # 获取视频的路径列表
+    # 获取视频的路径列表；manifest 里记录已完成且没有变化的视频会被跳过
     def __getVideoList(self):
+        skip_num = 0
         for file_name in os.listdir(self.VIDEO_PATH):
             if os.path.splitext(file_name)[1] != '.mp4':
                 continue
 
             video_path = os.path.join(self.VIDEO_PATH, file_name)   # 获取每个视频的路径
+            if self.__isDone(video_path):
+                skip_num += 1
+                continue
+
             self.__videoList.append(video_path)
 
+        if skip_num:
+            self.echo('skip %d unchanged videos (see %s)' % (skip_num, self.MANIFEST_PATH))
+
 
-    # 根据 video_path 读取视频，并每 IMG_PER_FRAME 帧保存一幅图片
-    def __getImage(self, video_path):
+    ''' 读取 manifest '''
+    def __loadManifest(self):
+        if not os.path.isfile(self.MANIFEST_PATH):
+            self.__manifest = {}
+            return
+
+        with open(self.MANIFEST_PATH, 'r') as f:
+            self.__manifest = json.load(f)
+
+
+    ''' 保存 manifest；先写临时文件再替换，避免中断时留下写了一半的文件 '''
+    def __saveManifest(self):
+        tmp_path = self.MANIFEST_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.__manifest, f, indent=2, sort_keys=True)
+
+        if os.path.isfile(self.MANIFEST_PATH):
+            os.remove(self.MANIFEST_PATH)
+        os.rename(tmp_path, self.MANIFEST_PATH)
+
+
+    ''' 视频文件的状态以及抽帧参数；任何一项变化都需要重新抽帧 (只记录当前 SAMPLE_MODE 用到的参数) '''
+    def __getVideoInfo(self, video_path):
+        stat_info = os.stat(video_path)
+        info = {
+            'size': stat_info.st_size,
+            'mtime': int(stat_info.st_mtime),
+            'sample_mode': self.SAMPLE_MODE,
+            'dedup': [self.DEDUP_METHOD, self.DEDUP_THRESHOLD] if self.USE_DEDUP else None,
+        }
+
+        if self.SAMPLE_MODE == FrameSampler.MODE_FRAME:
+            info['img_per_frame'] = self.IMG_PER_FRAME
+        else:
+            info['time_interval'] = self.TIME_INTERVAL
+        return info
+
+
+    ''' 判断视频是否已经按当前参数抽过帧 '''
+    def __isDone(self, video_path):
+        record = self.__manifest.get(os.path.split(video_path)[1])
+        if not record or not record.get('done'):
+            return False
+
+        for key, value in self.__getVideoInfo(video_path).items():
+            if record.get(key) != value:
+                return False
+        return True
+
+
+    ''' 删除该视频上一次运行输出的图片 (参数变化后图片数量可能变少，旧图片不会被覆盖) '''
+    def __removeOldImage(self, video_path):
+        record = self.__manifest.get(os.path.split(video_path)[1])
+        if not record:
+            return
+
+        video_no = os.path.splitext( os.path.split(video_path)[1] )[0]
+        for file_no in range(1, record.get('frames', 0) + 1):
+            img_path = os.path.join(self.IMG_PATH, '%s_%d.jpg' % (video_no, file_no))
+            if os.path.isfile(img_path):
+                os.remove(img_path)
+
+
+    ''' 视频处理完后记录到 manifest，并立即保存；中断后重新运行会从未完成的视频开始 '''
+    def __markDone(self, video_path, result):
+        record = self.__getVideoInfo(video_path)
+        record.update(result)
+        record['done'] = True
+
+        self.__report.append([video_path, result])
+
+        self.__manifest[os.path.split(video_path)[1]] = record
+        self.__saveManifest()
+
+
+    # 根据 video_path 读取视频，并按 SAMPLE_MODE 抽帧保存图片；不需要的帧只 grab 不解码
+    #   progress_queue 不为 None 时 (子进程中)，进度通过 progress_queue 汇报给主进程，而不是直接输出
+    #   返回该视频的抽帧结果 {'sampled': 抽到的帧数, 'frames': 保存的图片数量, 'dropped': 丢弃的重复帧数}
+    def __getImage(self, video_path, progress_queue=None):
         video_no = os.path.splitext( os.path.split(video_path)[1] )[0]  # video 编号
         file_no = 1                         # video 对应的图片的 no
 
-        cap = cv2.VideoCapture(video_path)  # 初始化 Video
-        if not cap.isOpened():              # 检查 video 是否打开
-            cap.open()
+        sampler = FrameSampler(video_path, self.SAMPLE_MODE, self.IMG_PER_FRAME, self.TIME_INTERVAL, self.USE_SEEK)
+        frame_num = sampler.get_frame_num()
 
-        ret, _ = cap.read()     # 因为第一次 cap.read() 返回的 ret 为 False
-        ret = True              # 重置 ret 为 True
+        dup_filter = DupFilter(self.DEDUP_METHOD, self.DEDUP_THRESHOLD) if self.USE_DEDUP else None
+        sampled = 0
 
-        count = 0
-        while ret:
-            ret, frame = cap.read() # 读取视频
-            count += 1
+        for frame_index, frame in sampler:
+            sampled += 1
+            if dup_filter and dup_filter.is_dup(frame):
+                continue
 
-            if count % self.IMG_PER_FRAME == 0:     # 每 IMG_PER_FRAME 帧保存一次图片
-                img_path = os.path.join(self.IMG_PATH, '%s_%d.jpg' % (video_no, file_no))
-                cv2.imwrite(img_path, frame)
-                file_no += 1
+            img_path = os.path.join(self.IMG_PATH, '%s_%d.jpg' % (video_no, file_no))
+            cv2.imwrite(img_path, frame)
+            file_no += 1
 
+            if progress_queue is None:
                 self.echo('save %s' % img_path)
+            else:
+                progress_queue.put([video_path, frame_index, frame_num])
+
+        sampler.close()         # 释放视频
+
+        return {
+            'sampled': sampled,
+            'frames': file_no - 1,
+            'dropped': dup_filter.get_drop() if dup_filter else 0,
+        }
 
-            cv2.waitKey(1)
 
-        cap.release()           # 释放视频
+    ''' 转换单个视频；供子进程调用 '''
+    def transformVideo(self, video_path, progress_queue=None):
+        return self.__getImage(video_path, progress_queue)
 
 
     ''' 输出展示 '''
     @staticmethod
     def echo(msg, crlf=True):
         if crlf:
-            print msg
+            print(msg)
         else:
             sys.stdout.write(msg)
             sys.stdout.flush()
 
 
-    # 主函数
-    def run(self):
-        self.__getVideoList()
-
+    ''' 在当前进程逐个转换视频 '''
+    def __runSerial(self):
         video_len = len(self.__videoList)
 
         for i, video_path in enumerate(self.__videoList):
             progress = float(i) / video_len * 100
             self.echo('progress: %.2f \t transforming %s \t \r' % (progress, video_path))
 
-            self.__getImage(video_path)
+            self.__removeOldImage(video_path)
+            self.__markDone(video_path, self.__getImage(video_path))
+
+        self.echo('')
+
+
+    ''' 用进程池并行转换视频，并汇总各个进程的进度 '''
+    def __runParallel(self):
+        video_len = len(self.__videoList)
+
+        manager = multiprocessing.Manager()
+        progress_queue = manager.Queue()
+        pool = multiprocessing.Pool(self.NUM_WORKERS)
+        max_in_flight = self.MAX_IN_FLIGHT or 2 * self.NUM_WORKERS
+
+        pending = list(self.__videoList)
+        running = []            # [video_path, AsyncResult]
+        progress = {}           # 每个视频已处理的比例
+        done_num = 0
+        save_num = 0
+
+        # 出错或 Ctrl-C 时结束子进程，并关闭 manager，避免留下孤儿进程
+        try:
+            while pending or running:
+                # 限制同时提交的视频数量，避免任务全部堆积在进程池里
+                while pending and len(running) < max_in_flight:
+                    video_path = pending.pop(0)
+                    self.__removeOldImage(video_path)
+                    running.append([video_path, pool.apply_async(_transform_video, (video_path, progress_queue))])
+
+                # 汇总子进程汇报的进度
+                msg_list = []
+                try:
+                    msg_list.append(progress_queue.get(timeout=0.2))
+                    while True:
+                        msg_list.append(progress_queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+                for video_path, count, frame_num in msg_list:
+                    progress[video_path] = min(float(count) / frame_num, 1.0) if frame_num > 0 else 0.0
+
+                still_running = []
+                for video_path, result in running:
+                    if not result.ready():
+                        still_running.append([video_path, result])
+                        continue
+
+                    video_result = result.get()     # 子进程若有异常，会在这里重新抛出
+                    self.__markDone(video_path, video_result)
+                    save_num += video_result['frames']
+                    done_num += 1
+                    progress[video_path] = 1.0
+                running = still_running
 
+                total_progress = sum(progress.values()) / video_len * 100
+                self.echo('\rprogress: %.2f%% \t videos: %d / %d \t saved: %d \t' % (total_progress, done_num,
+                                                                                      video_len, save_num), False)
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            manager.shutdown()
+
+        self.echo('')
+
+
+    ''' 输出本次运行的抽帧报告；开启去重时包括每个视频的丢弃率 '''
+    def __showReport(self):
+        if not self.__report:
+            return
+
+        self.echo('\n%-24s %8s %8s %8s %10s' % ('video', 'sampled', 'saved', 'dropped', 'drop_rate'))
+        for video_path, result in sorted(self.__report, key=lambda x: x[0]):
+            drop_rate = float(result['dropped']) / result['sampled'] * 100 if result['sampled'] else 0.0
+            self.echo('%-24s %8d %8d %8d %9.2f%%' % (os.path.split(video_path)[1], result['sampled'],
+                                                    result['frames'], result['dropped'], drop_rate))
+
+
+    # 主函数
+    def run(self):
+        self.__loadManifest()
+        self.__getVideoList()
+
+        if self.NUM_WORKERS > 1 and len(self.__videoList) > 1:
+            self.__runParallel()
+        else:
+            self.__runSerial()
+
+        self.__showReport()
         self.echo('\ndone')
 
 
-o_transformer = Transformer()
-o_transformer.run()
+''' 进程池的任务函数；需要定义在模块层，才能被 pickle '''
+def _transform_video(video_path, progress_queue):
+    return Transformer().transformVideo(video_path, progress_queue)
+
+
+if __name__ == '__main__':
+    o_transformer = Transformer()
+    o_transformer.run()